@@ -0,0 +1,102 @@
+import asyncio
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Events that are safe to delay by a few ms; anything else (permission
+# requests, results, errors) flushes the open batch and goes out on its own.
+BATCHABLE_EVENTS = {"text", "text_delta", "thinking", "tool_use", "tool_result"}
+
+
+def batch_frame(event_type: str, datas: List[bytes]) -> Dict[str, Any]:
+    # The items are already encoded JSON, so splice them rather than re-encode
+    return {
+        "event": "batch",
+        "data": b'{"type": "'
+        + event_type.encode("utf-8")
+        + b'", "events": ['
+        + b", ".join(datas)
+        + b"]}",
+    }
+
+
+async def coalesce_events(
+    queue: asyncio.Queue,
+    done: object,
+    window_ms: Optional[int] = None,
+    max_bytes: int = 65536,
+    tap: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Yield events from queue until done, merging runs of the same type.
+
+    With window_ms unset every event is yielded as-is. Otherwise consecutive
+    batchable events of one type arriving within window_ms of the first,
+    up to max_bytes of data, are yielded as a single batch frame. tap, if
+    given, sees every event as it comes off the queue, before any merging.
+    """
+    loop = asyncio.get_running_loop()
+    pending = None
+
+    while True:
+        if pending is not None:
+            event, pending = pending, None
+        else:
+            event = await queue.get()
+            if tap is not None and event is not done:
+                tap(event)
+        if event is done:
+            return
+
+        if not window_ms or event["event"] not in BATCHABLE_EVENTS:
+            yield event
+            continue
+
+        datas = [event["data"]]
+        size = len(event["data"])
+        deadline = loop.time() + window_ms / 1000
+
+        while size < max_bytes:
+            try:
+                following = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    following = await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            if tap is not None and following is not done:
+                tap(following)
+            if following is done or following["event"] != event["event"]:
+                pending = following
+                break
+            datas.append(following["data"])
+            size += len(following["data"])
+
+        yield event if len(datas) == 1 else batch_frame(event["event"], datas)
+
+
+def coalesce_frames(
+    frames: Iterable[Tuple[str, bytes]], max_bytes: int = 65536
+) -> Iterator[Tuple[str, bytes]]:
+    """coalesce_events for (event, data) frames that are all available already."""
+    run: List[bytes] = []
+    run_type = None
+    for event, data in frames:
+        if run and (event != run_type or sum(map(len, run)) >= max_bytes):
+            yield flush_run(run_type, run)
+            run = []
+        if event in BATCHABLE_EVENTS:
+            run_type = event
+            run.append(data)
+        else:
+            yield event, data
+    if run:
+        yield flush_run(run_type, run)
+
+
+def flush_run(event_type: str, datas: List[bytes]) -> Tuple[str, bytes]:
+    if len(datas) == 1:
+        return event_type, datas[0]
+    frame = batch_frame(event_type, datas)
+    return frame["event"], frame["data"]
@@ -0,0 +1,141 @@
+import asyncio
+import dataclasses
+import gzip
+import itertools
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, List, Tuple
+
+from claude_agent_sdk import types as sdk_types
+
+log = logging.getLogger(__name__)
+
+FIXTURE_VERSION = 1
+
+
+def encode_value(value: Any) -> Any:
+    """SDK dataclasses to JSON-able dicts tagged with their class name."""
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        encoded = {"_type": type(value).__name__}
+        for field in dataclasses.fields(value):
+            if field.init:
+                encoded[field.name] = encode_value(getattr(value, field.name))
+        return encoded
+    if isinstance(value, (list, tuple)):
+        return [encode_value(item) for item in value]
+    if isinstance(value, dict):
+        return {key: encode_value(item) for key, item in value.items()}
+    return value
+
+
+def decode_value(value: Any) -> Any:
+    if isinstance(value, list):
+        return [decode_value(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    fields = {key: decode_value(item) for key, item in value.items() if key != "_type"}
+    cls = getattr(sdk_types, value.get("_type", ""), None)
+    if cls is None:
+        return fields
+    return cls(**fields)
+
+
+class Recorder:
+    """Collects one query's messages with their arrival offsets, then writes a fixture.
+
+    A fixture is gzipped JSONL: a header line, then one {"t": ms, "message": ...}
+    line per message in the order receive_response() produced them.
+    """
+
+    def __init__(self, prompt: str = ""):
+        self.started = time.perf_counter()
+        self.header = {
+            "version": FIXTURE_VERSION,
+            "recorded_at": time.time(),
+            "prompt_chars": len(prompt),
+        }
+        self.entries: List[Tuple[float, Any]] = []
+
+    def add(self, message: Any):
+        # Only timestamp here; encoding waits for write() on a worker thread
+        offset_ms = round((time.perf_counter() - self.started) * 1000, 3)
+        self.entries.append((offset_ms, message))
+
+    def write(self, path: Path) -> Path:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            f.write(json.dumps(self.header) + "\n")
+            for offset_ms, message in self.entries:
+                line = {"t": offset_ms, "message": encode_value(message)}
+                f.write(json.dumps(line, default=str) + "\n")
+        return path
+
+    async def save(self, directory: str, label: str) -> Path:
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{label}-{os.getpid()}-{id(self):x}.jsonl.gz"
+        # gzip and the disk write stay off the event loop
+        path = await asyncio.to_thread(self.write, Path(directory) / name)
+        log.info("Recorded fixture", extra={"path": str(path), "messages": len(self.entries)})
+        return path
+
+
+def load_fixture(path: Path) -> List[Tuple[float, Any]]:
+    """(offset in ms, SDK message) pairs, decoded up front so replay stays cheap."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        if header.get("version") != FIXTURE_VERSION:
+            raise ValueError(f"Unsupported fixture version in {path}: {header.get('version')}")
+        entries = [json.loads(line) for line in f if line.strip()]
+    return [(entry["t"], decode_value(entry["message"])) for entry in entries]
+
+
+def fixture_paths(source: str) -> List[Path]:
+    path = Path(source)
+    paths = sorted(path.glob("*.jsonl.gz")) if path.is_dir() else [path]
+    if not paths:
+        raise FileNotFoundError(f"No fixtures found at {source}")
+    return paths
+
+
+class ReplayClient:
+    """Stands in for ClaudeSDKClient, replaying recorded fixtures.
+
+    Each query() takes the next fixture, cycling through a directory in name
+    order. speed 1.0 keeps the recorded timing, 2.0 halves every gap, and 0
+    replays as fast as possible.
+    """
+
+    def __init__(self, source: str, speed: float = 1.0):
+        self.paths = itertools.cycle(fixture_paths(source))
+        self.speed = speed
+        self.entries: List[Tuple[float, Any]] = []
+
+    async def connect(self, prompt=None):
+        pass
+
+    async def disconnect(self):
+        pass
+
+    async def interrupt(self):
+        self.entries = []
+
+    async def query(self, prompt: str, session_id: str = "default"):
+        path = next(self.paths)
+        self.entries = await asyncio.to_thread(load_fixture, path)
+
+    async def receive_response(self):
+        started = time.perf_counter()
+        entries = self.entries
+        for offset_ms, message in entries:
+            if self.entries is not entries:
+                # interrupt() swapped the script out; stop like the CLI would
+                return
+            if self.speed > 0:
+                delay = started + offset_ms / 1000 / self.speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            else:
+                await asyncio.sleep(0)
+            yield message
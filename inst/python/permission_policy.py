@@ -0,0 +1,143 @@
+import fnmatch
+import hashlib
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Input keys that carry the path a file tool operates on
+PATH_KEYS = ("file_path", "path", "notebook_path")
+
+# A command containing any of these is never matched by a prefix allow rule,
+# so "git status" cannot be stretched into "git status; rm -rf ~"
+SHELL_OPERATORS = (";", "&", "|", "`", "$(", ">", "<", "\n")
+
+REMEMBER_SCOPES = ("input", "tool")
+
+
+def input_key(input_data: Dict[str, Any]) -> str:
+    blob = json.dumps(input_data, sort_keys=True, default=str)
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()
+
+
+class PermissionRule:
+    """Allow or deny one tool ("*" for any), optionally only for some inputs.
+
+    paths are globs matched against the tool's target path; relative globs
+    are relative to the working dir and never match outside it.
+    command_prefixes match the start of a Bash command.
+    """
+
+    def __init__(
+        self,
+        tool: str,
+        action: str,
+        paths: Optional[Sequence[str]] = None,
+        command_prefixes: Optional[Sequence[str]] = None,
+    ):
+        if action not in ("allow", "deny"):
+            raise ValueError(f"Rule action must be 'allow' or 'deny', not {action!r}")
+        self.tool = tool
+        self.action = action
+        self.paths = list(paths) if paths is not None else None
+        self.command_prefixes = list(command_prefixes) if command_prefixes is not None else None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "PermissionRule":
+        unknown = set(data) - {"tool", "action", "paths", "command_prefixes"}
+        if unknown:
+            raise ValueError(f"Unknown rule fields: {', '.join(sorted(unknown))}")
+        if "tool" not in data or "action" not in data:
+            raise ValueError("Rules need a tool and an action")
+        return cls(data["tool"], data["action"], data.get("paths"), data.get("command_prefixes"))
+
+    def _path_matches(self, input_data: Dict[str, Any], working_dir: Optional[str]) -> bool:
+        target = next((input_data[k] for k in PATH_KEYS if isinstance(input_data.get(k), str)), None)
+        if target is None:
+            return False
+        base = working_dir or os.getcwd()
+        absolute = os.path.normpath(os.path.join(base, os.path.expanduser(target)))
+        relative = os.path.relpath(absolute, base)
+        inside = relative != ".." and not relative.startswith(".." + os.sep)
+
+        for pattern in self.paths:
+            pattern = os.path.expanduser(pattern)
+            if os.path.isabs(pattern):
+                if fnmatch.fnmatch(absolute, pattern):
+                    return True
+            elif inside and fnmatch.fnmatch(relative, pattern):
+                return True
+        return False
+
+    def _command_matches(self, input_data: Dict[str, Any]) -> bool:
+        command = input_data.get("command")
+        if not isinstance(command, str):
+            return False
+        command = command.strip()
+        if self.action == "allow" and any(op in command for op in SHELL_OPERATORS):
+            return False
+        return any(
+            command == prefix or command.startswith(prefix.rstrip() + " ")
+            for prefix in self.command_prefixes
+        )
+
+    def matches(self, input_data: Dict[str, Any], working_dir: Optional[str]) -> bool:
+        if self.paths is not None and not self._path_matches(input_data, working_dir):
+            return False
+        if self.command_prefixes is not None and not self._command_matches(input_data):
+            return False
+        return True
+
+
+class PermissionPolicy:
+    """Decides tool permissions in-process before a request reaches the UI.
+
+    Remembered decisions are dict lookups, keyed by tool name or by tool name
+    plus a hash of the exact input. Rules are indexed by tool name, so only
+    the rules for that tool (and "*") are ever scanned. Deny rules win over
+    everything, including remembered approvals.
+    """
+
+    def __init__(self, rules: Iterable[PermissionRule] = (), working_dir: Optional[str] = None):
+        self.working_dir = working_dir
+        self.rules: Dict[str, List[PermissionRule]] = {}
+        self.tool_decisions: Dict[str, bool] = {}
+        self.input_decisions: Dict[Tuple[str, str], bool] = {}
+        for rule in rules:
+            self.rules.setdefault(rule.tool, []).append(rule)
+
+    @classmethod
+    def from_dicts(
+        cls, rules: Optional[List[Dict[str, Any]]], working_dir: Optional[str] = None
+    ) -> "PermissionPolicy":
+        return cls([PermissionRule.from_dict(rule) for rule in rules or []], working_dir)
+
+    def decide(self, tool_name: str, input_data: Dict[str, Any]) -> Optional[Tuple[bool, str]]:
+        """(approved, source) when no human is needed, otherwise None.
+
+        A matching deny rule always wins; remembered decisions come next and
+        override allow rules, which are consulted last.
+        """
+        candidates = self.rules.get(tool_name, []) + self.rules.get("*", [])
+        matched = [rule for rule in candidates if rule.matches(input_data, self.working_dir)]
+        if any(rule.action == "deny" for rule in matched):
+            return False, "rule"
+
+        if self.input_decisions:
+            remembered = self.input_decisions.get((tool_name, input_key(input_data)))
+            if remembered is not None:
+                return remembered, "remembered"
+        remembered = self.tool_decisions.get(tool_name)
+        if remembered is not None:
+            return remembered, "remembered"
+
+        if matched:
+            return True, "rule"
+        return None
+
+    def remember(self, tool_name: str, input_data: Dict[str, Any], approved: bool, scope: str):
+        if scope == "tool":
+            self.tool_decisions[tool_name] = approved
+        elif scope == "input":
+            self.input_decisions[(tool_name, input_key(input_data))] = approved
+        else:
+            raise ValueError(f"remember must be one of {REMEMBER_SCOPES}, not {scope!r}")
@@ -0,0 +1,139 @@
+import asyncio
+from collections import deque
+from typing import Deque, Dict, Tuple
+
+
+class QueueFull(Exception):
+    """The session already has as many queries waiting as it may."""
+
+
+class Ticket:
+    """One query's place in line; wait on changed() to hear it move."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.granted = False
+        self.cancelled = False
+        self._changed = asyncio.get_running_loop().create_future()
+
+    def _notify(self):
+        if not self._changed.done():
+            self._changed.set_result(None)
+
+    async def changed(self):
+        await self._changed
+        self._changed = asyncio.get_running_loop().create_future()
+
+
+class QueryScheduler:
+    """Runs queries one at a time per session, taking turns across sessions.
+
+    Each session has a FIFO holding its running query plus at most
+    max_waiting more. Only the head of a session's FIFO competes for the
+    server-wide max_running slots (0 = unlimited), and slots are handed out
+    in the order heads became ready. A session with a deep backlog therefore
+    gets one slot at a time like everyone else, and its next query goes to
+    the back of the server line.
+    """
+
+    def __init__(self, max_waiting: int = 4, max_running: int = 0):
+        self.max_waiting = max_waiting
+        self.max_running = max_running
+        self.queues: Dict[str, Deque[Ticket]] = {}
+        # Session heads waiting for a server slot, in arrival order
+        self.ready: Deque[Ticket] = deque()
+        self.running = 0
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self.queues.values()) - self.running
+
+    def submit(self, key: str) -> Ticket:
+        queue = self.queues.setdefault(key, deque())
+        if len(queue) > self.max_waiting:
+            raise QueueFull(f"{len(queue)} queries already queued or running for this session")
+        ticket = Ticket(key)
+        queue.append(ticket)
+        if len(queue) == 1:
+            self._make_ready(ticket)
+        return ticket
+
+    def position(self, ticket: Ticket) -> Tuple[int, str]:
+        """(queries ahead, "session" or "server"); (0, "running") once granted."""
+        if ticket.granted:
+            return 0, "running"
+        queue = self.queues.get(ticket.key, ())
+        if queue and queue[0] is ticket:
+            return self.ready.index(ticket) + 1, "server"
+        return list(queue).index(ticket), "session"
+
+    async def wait(self, ticket: Ticket, on_position=None) -> bool:
+        """Wait for ticket's turn, awaiting on_position(ahead, scope) whenever it moves.
+
+        Returns False if the ticket was cancelled while waiting.
+        """
+        last = None
+        while not ticket.granted and not ticket.cancelled:
+            current = self.position(ticket)
+            if on_position is not None and current != last:
+                await on_position(*current)
+                last = current
+            if ticket.granted or ticket.cancelled:
+                break
+            await ticket.changed()
+        return ticket.granted
+
+    def cancel(self, ticket: Ticket) -> bool:
+        """Withdraw a ticket that has not started; False if it already runs."""
+        if ticket.granted or ticket.cancelled:
+            return False
+        ticket.cancelled = True
+        self._remove(ticket)
+        ticket._notify()
+        return True
+
+    def release(self, ticket: Ticket):
+        """The ticket's query is finished (or never ran); let the next one in."""
+        if ticket.granted:
+            ticket.granted = False
+            self.running -= 1
+        ticket.cancelled = True
+        self._remove(ticket)
+
+    def _remove(self, ticket: Ticket):
+        queue = self.queues.get(ticket.key)
+        if not queue or ticket not in queue:
+            return
+        was_head = queue[0] is ticket
+        queue.remove(ticket)
+        if ticket in self.ready:
+            self.ready.remove(ticket)
+        if not queue:
+            del self.queues[ticket.key]
+        elif was_head:
+            self._make_ready(queue[0])
+        else:
+            self._notify_session(ticket.key)
+        self._dispatch()
+
+    def _make_ready(self, ticket: Ticket):
+        self.ready.append(ticket)
+        self._notify_session(ticket.key)
+        self._dispatch()
+
+    def _dispatch(self):
+        moved = False
+        while self.ready and (not self.max_running or self.running < self.max_running):
+            ticket = self.ready.popleft()
+            ticket.granted = True
+            self.running += 1
+            ticket._notify()
+            moved = True
+        if moved:
+            # Everyone still in the server line moved up
+            for ticket in self.ready:
+                ticket._notify()
+
+    def _notify_session(self, key: str):
+        for ticket in self.queues.get(key, ()):
+            ticket._notify()
@@ -0,0 +1,70 @@
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from typing import Optional
+
+# Attributes every LogRecord has; anything else was passed through extra=
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only merge args here; the formatter and any traceback rendering
+        # run on the listener thread, unlike the stdlib prepare().
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+def setup_logging(
+    level: Optional[str] = None, fmt: Optional[str] = None
+) -> logging.handlers.QueueListener:
+    """Route all server logging through a queue drained by a background thread.
+
+    The event loop only pays for enqueueing a record; formatting and the
+    stderr write happen on the listener thread. Level and format come from
+    CLAUDE_LOG_LEVEL (default INFO) and CLAUDE_LOG_FORMAT (json or text).
+    """
+    level = (level or os.environ.get("CLAUDE_LOG_LEVEL", "INFO")).upper()
+    fmt = fmt or os.environ.get("CLAUDE_LOG_FORMAT", "json")
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    if fmt == "text":
+        stream_handler.setFormatter(
+            logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+        )
+    else:
+        stream_handler.setFormatter(JsonFormatter())
+
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, stream_handler)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            root.removeHandler(handler)
+    root.addHandler(QueueHandler(records))
+    root.setLevel(level)
+
+    listener.start()
+    return listener
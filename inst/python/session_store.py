@@ -0,0 +1,90 @@
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+log = logging.getLogger(__name__)
+
+# Initialize options worth restoring with a conversation. Credentials and
+# env are deliberately absent: they come fresh from the client every time.
+RESUMABLE_OPTIONS = (
+    "model",
+    "system_prompt",
+    "allowed_tools",
+    "disallowed_tools",
+    "max_turns",
+    "add_dirs",
+)
+
+
+class SessionStore:
+    """Conversations the server has run, kept in a JSON file across restarts.
+
+    Entries are {"working_dir", "options", "updated"} keyed by the SDK
+    session id. Nothing here is ever listed or looked up by directory: a
+    client resumes only by presenting the session id it was given, and only
+    in the working dir the conversation ran in, so users sharing a server
+    (and a project) never pick up each other's conversations. The least
+    recently updated entries are dropped beyond max_entries. A missing or
+    unreadable file is treated as empty.
+    """
+
+    def __init__(self, path: str, max_entries: int = 256):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries: Dict[str, Dict[str, Any]] = self._load()
+
+    @staticmethod
+    def key(working_dir: str) -> str:
+        return os.path.realpath(os.path.expanduser(working_dir))
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            log.warning("Ignoring unreadable session store %s: %s", self.path, e)
+            return {}
+        if not isinstance(entries, dict):
+            return {}
+        return {
+            session_id: entry
+            for session_id, entry in entries.items()
+            if isinstance(entry, dict) and entry.get("working_dir")
+        }
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        # Atomic, so a crash mid-write leaves the previous file intact
+        os.replace(tmp, self.path)
+
+    def get(self, session_id: str, working_dir: str) -> Optional[Dict[str, Any]]:
+        """The saved entry for session_id, if it ran in working_dir."""
+        entry = self.entries.get(session_id)
+        if entry is None or entry["working_dir"] != self.key(working_dir):
+            return None
+        return entry
+
+    def put(self, session_id: str, working_dir: str, options: Dict[str, Any]):
+        self.entries[session_id] = {
+            "working_dir": self.key(working_dir),
+            "options": {k: options.get(k) for k in RESUMABLE_OPTIONS if options.get(k) is not None},
+            "updated": time.time(),
+        }
+        if len(self.entries) > self.max_entries:
+            by_age = sorted(self.entries, key=lambda k: self.entries[k].get("updated", 0))
+            for session_id in by_age[: len(self.entries) - self.max_entries]:
+                del self.entries[session_id]
+        self._save()
+
+    def remove(self, session_id: str) -> bool:
+        if self.entries.pop(session_id, None) is None:
+            return False
+        self._save()
+        return True
@@ -0,0 +1,4 @@
+"""Offline benchmarks for sdk_server; nothing here starts the real CLI.
+
+Run from the python/ directory, e.g. ``python -m bench.pipeline --help``.
+"""
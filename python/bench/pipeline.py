@@ -0,0 +1,298 @@
+"""Drive the /query SSE pipeline end to end against ScriptedClient.
+
+The app runs in-process behind httpx's ASGI transport, so no CLI, network
+or credentials are needed. Per-event latency is measured from the moment a
+block leaves receive_response() to the moment its SSE frame is handed to
+the ASGI send(), i.e. everything the server itself adds.
+
+    python -m bench.pipeline --scenario tools --sessions 16 --queries 5
+    python -m bench.pipeline --save-baseline      # record bench/baseline.json
+    python -m bench.pipeline                      # compare against it
+    python -m bench.pipeline --fixtures /path/to/recordings
+
+Exits with status 1 when a metric regresses past --tolerance.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+os.environ.setdefault("CLAUDE_LOG_LEVEL", "WARNING")
+os.environ.setdefault("CLAUDE_POOL_MIN_SIZE", "0")
+os.environ.setdefault("CLAUDE_SESSION_STORE", "")
+
+import httpx  # noqa: E402
+
+import sdk_server  # noqa: E402
+from bench.scripted_client import (  # noqa: E402
+    SCENARIOS,
+    FixtureClient,
+    ScriptedClient,
+    build_script,
+)
+from serializer import backend  # noqa: E402
+
+CONTENT_EVENTS = {"text", "text_delta", "thinking", "tool_use", "tool_result"}
+
+# name -> (bigger is better, absolute change always treated as noise)
+COMPARED = {
+    "events_per_sec": (True, 0.0),
+    "latency_ms.p50": (False, 0.05),
+    "latency_ms.p99": (False, 0.1),
+    "loop_lag_ms.p99": (False, 2.0),
+    "peak_rss_mb": (False, 5.0),
+}
+
+
+class TimedApp:
+    """ASGI wrapper that timestamps every response body chunk of /query."""
+
+    def __init__(self, app):
+        self.app = app
+        self.arrivals: Dict[str, List[Tuple[float, bytes]]] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != "/query":
+            return await self.app(scope, receive, send)
+
+        token = dict(scope["headers"]).get(b"x-session-token", b"").decode()
+        arrivals = self.arrivals[token] = []
+
+        async def timed_send(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                arrivals.append((time.perf_counter(), message["body"]))
+            await send(message)
+
+        await self.app(scope, receive, timed_send)
+
+
+def content_events(chunk: bytes) -> int:
+    """Number of content events carried by one body chunk of SSE frames."""
+    count = 0
+    for frame in chunk.split(b"\r\n\r\n"):
+        event, data = None, None
+        for line in frame.split(b"\r\n"):
+            if line.startswith(b"event: "):
+                event = line[7:].decode()
+            elif line.startswith(b"data: "):
+                data = line[6:]
+        if event == "batch":
+            batch = json.loads(data)
+            if batch["type"] in CONTENT_EVENTS:
+                count += len(batch["events"])
+        elif event in CONTENT_EVENTS:
+            count += 1
+    return count
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))]
+
+
+async def watch_loop_lag(samples: List[float], stop: asyncio.Event, interval: float = 0.005):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - started - interval)
+
+
+async def run_session(
+    http: httpx.AsyncClient, timed: TimedApp, queries: int, batch_window_ms
+) -> List[Tuple[List[float], List[Tuple[float, bytes]]]]:
+    resp = await http.post(
+        "/initialize", json={"working_dir": str(BENCH_DIR), "auth_method": "subscription"}
+    )
+    resp.raise_for_status()
+    token = resp.json()["session_token"]
+    headers = {"X-Session-Token": token}
+    # Matched up after the run so the harness adds no work to the timed loop
+    captured = []
+
+    for _ in range(queries):
+        body = {"prompt": "benchmark"}
+        if batch_window_ms:
+            body["batch_window_ms"] = batch_window_ms
+        resp = await http.post("/query", json=body, headers=headers)
+        resp.raise_for_status()
+
+        sent_at = sdk_server.sessions.get(token).sdk_client.sent_at
+        captured.append((sent_at, timed.arrivals.pop(token, [])))
+
+    await http.post("/shutdown", headers=headers)
+    return captured
+
+
+def event_latencies(sent_at: List[float], arrivals: List[Tuple[float, bytes]]) -> List[float]:
+    latencies = []
+    for arrived, chunk in arrivals:
+        for _ in range(content_events(chunk)):
+            latencies.append(arrived - sent_at[len(latencies)])
+    if len(latencies) != len(sent_at):
+        raise RuntimeError(f"Expected {len(sent_at)} content events, saw {len(latencies)}")
+    return latencies
+
+
+async def run(args) -> Dict:
+    if args.fixtures:
+        FixtureClient.source = args.fixtures
+        FixtureClient.speed = args.replay_speed
+        sdk_server.ClaudeSDKClient = FixtureClient
+    else:
+        ScriptedClient.script = build_script(
+            args.scenario,
+            turns=args.turns,
+            text_bytes=args.text_bytes,
+            thinking_bytes=args.thinking_bytes,
+            tool_input_bytes=args.tool_input_bytes,
+            tool_result_bytes=args.tool_result_bytes,
+        )
+        ScriptedClient.message_delay = args.message_delay_ms / 1000
+        sdk_server.ClaudeSDKClient = ScriptedClient
+
+    app = sdk_server.app
+    timed = TimedApp(app)
+    lag_samples: List[float] = []
+    stop = asyncio.Event()
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=timed)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench", timeout=None
+        ) as http:
+            # The first query pays for lazy imports (anyio's backend, sse_starlette)
+            await run_session(http, timed, 1, args.batch_window_ms)
+            watcher = asyncio.create_task(watch_loop_lag(lag_samples, stop))
+            started = time.perf_counter()
+            per_session = await asyncio.gather(
+                *(
+                    run_session(http, timed, args.queries, args.batch_window_ms)
+                    for _ in range(args.sessions)
+                )
+            )
+            elapsed = time.perf_counter() - started
+            stop.set()
+            await watcher
+
+    latencies = [
+        value
+        for session in per_session
+        for sent_at, arrivals in session
+        for value in event_latencies(sent_at, arrivals)
+    ]
+    return {
+        "config": {
+            "scenario": args.scenario,
+            "sessions": args.sessions,
+            "queries": args.queries,
+            "turns": args.turns,
+            "text_bytes": args.text_bytes,
+            "thinking_bytes": args.thinking_bytes,
+            "tool_input_bytes": args.tool_input_bytes,
+            "tool_result_bytes": args.tool_result_bytes,
+            "message_delay_ms": args.message_delay_ms,
+            "batch_window_ms": args.batch_window_ms,
+            "fixtures": args.fixtures,
+            "replay_speed": args.replay_speed,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "serializer": backend(),
+        },
+        "events": len(latencies),
+        "elapsed_s": round(elapsed, 4),
+        "events_per_sec": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 4),
+            "p99": round(percentile(latencies, 99) * 1000, 4),
+            "max": round(max(latencies, default=0) * 1000, 4),
+        },
+        "loop_lag_ms": {
+            "p99": round(percentile(lag_samples, 99) * 1000, 4),
+            "max": round(max(lag_samples, default=0) * 1000, 4),
+        },
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def lookup(result: Dict, dotted: str) -> float:
+    value = result
+    for part in dotted.split("."):
+        value = value[part]
+    return value
+
+
+def compare(result: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    regressions = []
+    for name, (higher_is_better, slack) in COMPARED.items():
+        now, before = lookup(result, name), lookup(baseline, name)
+        if not before:
+            continue
+        change = (now - before) / before
+        worse = -change if higher_is_better else change
+        regressed = worse > tolerance and abs(now - before) > slack
+        status = "REGRESSED" if regressed else "ok"
+        print(f"  {name:18} {before:>12} -> {now:>12}  ({change:+.1%}) {status}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", choices=SCENARIOS, default="mixed")
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--text-bytes", type=int, default=400)
+    parser.add_argument("--thinking-bytes", type=int, default=4000)
+    parser.add_argument("--tool-input-bytes", type=int, default=20000)
+    parser.add_argument("--tool-result-bytes", type=int, default=20000)
+    parser.add_argument("--message-delay-ms", type=float, default=0.0)
+    parser.add_argument("--batch-window-ms", type=int, default=None)
+    parser.add_argument(
+        "--fixtures", help="replay recorded fixtures (CLAUDE_RECORD_DIR output) instead"
+    )
+    parser.add_argument("--replay-speed", type=float, default=0.0)
+    parser.add_argument("--baseline", type=Path, default=BENCH_DIR / "baseline.json")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(result, indent=2) + "\n")
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one")
+        return
+
+    baseline = json.loads(args.baseline.read_text())
+    if baseline["config"] != result["config"]:
+        print("Baseline was recorded with a different configuration; not comparing")
+        return
+
+    print(f"Compared with {args.baseline}:")
+    regressions = compare(result, baseline, args.tolerance)
+    if regressions:
+        print(f"Regressions beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""A ClaudeSDKClient stand-in that plays back a generated message script."""
+import asyncio
+import time
+from typing import Any, List, Optional
+
+from claude_agent_sdk.types import (
+    AssistantMessage,
+    ResultMessage,
+    TextBlock,
+    ThinkingBlock,
+    ToolResultBlock,
+    ToolUseBlock,
+    UserMessage,
+)
+
+from message_recorder import ReplayClient
+
+SCENARIOS = ("text", "thinking", "tools", "mixed")
+
+
+def emitted_events(message: Any) -> int:
+    """How many content events sdk_server's run_query sends for one message."""
+    if type(message).__name__ == "StreamEvent":
+        event = message.event or {}
+        delta = event.get("delta") or {}
+        return int(
+            event.get("type") == "content_block_delta" and delta.get("type") == "text_delta"
+        )
+    content = getattr(message, "content", None)
+    if not isinstance(content, list):
+        return 0
+    count = 0
+    for block in content:
+        name = type(block).__name__
+        if name in ("ThinkingBlock", "ToolUseBlock") or hasattr(block, "text"):
+            count += 1
+        elif name == "ToolResultBlock" and isinstance(block.content, str):
+            count += 1
+    return count
+
+
+def filler(size: int, seed: int) -> str:
+    line = f"line {seed}: the quick brown fox jumps over the lazy dog\n"
+    return (line * (size // len(line) + 1))[:size]
+
+
+def build_script(
+    scenario: str,
+    turns: int = 20,
+    text_bytes: int = 400,
+    thinking_bytes: int = 4000,
+    tool_input_bytes: int = 20000,
+    tool_result_bytes: int = 20000,
+) -> List[Any]:
+    """Messages for one query; every block becomes exactly one server event."""
+    if scenario not in SCENARIOS:
+        raise ValueError(f"Unknown scenario {scenario!r}, expected one of {SCENARIOS}")
+
+    messages = []
+    for turn in range(turns):
+        kind = scenario if scenario != "mixed" else SCENARIOS[turn % 3]
+        if kind == "text":
+            messages.append(
+                AssistantMessage(content=[TextBlock(text=filler(text_bytes, turn))], model="bench")
+            )
+        elif kind == "thinking":
+            messages.append(
+                AssistantMessage(
+                    content=[
+                        ThinkingBlock(thinking=filler(thinking_bytes, turn), signature="sig"),
+                        TextBlock(text=filler(text_bytes, turn)),
+                    ],
+                    model="bench",
+                )
+            )
+        else:
+            tool_id = f"toolu_bench_{turn}"
+            messages.append(
+                AssistantMessage(
+                    content=[
+                        ToolUseBlock(
+                            id=tool_id,
+                            name="Write",
+                            input={
+                                "file_path": f"R/bench_{turn}.R",
+                                "content": filler(tool_input_bytes, turn),
+                            },
+                        )
+                    ],
+                    model="bench",
+                )
+            )
+            messages.append(
+                UserMessage(
+                    content=[
+                        ToolResultBlock(
+                            tool_use_id=tool_id, content=filler(tool_result_bytes, turn)
+                        )
+                    ]
+                )
+            )
+
+    messages.append(
+        ResultMessage(
+            subtype="success",
+            duration_ms=1,
+            duration_api_ms=1,
+            is_error=False,
+            num_turns=turns,
+            session_id="bench-session",
+            total_cost_usd=0.0,
+            usage={"input_tokens": 0, "output_tokens": 0},
+        )
+    )
+    return messages
+
+
+class ScriptedClient:
+    """Replaces sdk_server.ClaudeSDKClient; no CLI process is started.
+
+    Set ScriptedClient.script before initializing sessions. Every instance
+    records when each content block left receive_response() in sent_at,
+    so the harness can line those times up with the events on the wire.
+    """
+
+    script: List[Any] = []
+    message_delay: float = 0.0
+
+    def __init__(self, options=None):
+        self.options = options
+        self.sent_at: List[float] = []
+        self.prompt: Optional[str] = None
+
+    async def connect(self, prompt=None):
+        pass
+
+    async def disconnect(self):
+        pass
+
+    async def interrupt(self):
+        pass
+
+    async def query(self, prompt: str, session_id: str = "default"):
+        self.prompt = prompt
+        self.sent_at = []
+
+    async def receive_response(self):
+        for message in self.script:
+            if self.message_delay:
+                await asyncio.sleep(self.message_delay)
+            else:
+                # Still let the consumer run between messages, as a real
+                # subprocess read would
+                await asyncio.sleep(0)
+            self.sent_at.extend([time.perf_counter()] * emitted_events(message))
+            yield message
+
+
+class FixtureClient(ReplayClient):
+    """ReplayClient that records sent_at the same way ScriptedClient does.
+
+    Set FixtureClient.source (a fixture file or directory) and speed first.
+    """
+
+    source: str = ""
+    speed: float = 0.0
+
+    def __init__(self, options=None):
+        super().__init__(self.source, self.speed)
+        self.options = options
+        self.sent_at: List[float] = []
+
+    async def query(self, prompt: str, session_id: str = "default"):
+        await super().query(prompt, session_id)
+        self.sent_at = []
+
+    async def receive_response(self):
+        async for message in super().receive_response():
+            self.sent_at.extend([time.perf_counter()] * emitted_events(message))
+            yield message
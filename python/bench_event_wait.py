@@ -0,0 +1,97 @@
+"""Micro-benchmark: polled two-queue /query pipeline vs the single awaited queue.
+
+Reproduces the shape of the old event_generator (permission_monitor polling
+permission_queue and the consumer polling event_queue, both with 100 ms
+wait_for timeouts) next to the current one (one queue closed by a sentinel),
+without starting the server or the CLI.
+
+    python bench_event_wait.py [--streams 200] [--idle 2.0] [--requests 50]
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+DONE = object()
+
+
+async def polled_stream(inbox: asyncio.Queue, received: list, stop: asyncio.Event):
+    event_queue = asyncio.Queue()
+
+    async def permission_monitor():
+        while not stop.is_set():
+            try:
+                item = await asyncio.wait_for(inbox.get(), timeout=0.1)
+                await event_queue.put(item)
+            except asyncio.TimeoutError:
+                continue
+
+    monitor = asyncio.create_task(permission_monitor())
+    while not stop.is_set() or not event_queue.empty():
+        try:
+            sent_at = await asyncio.wait_for(event_queue.get(), timeout=0.1)
+            if sent_at is DONE:
+                continue
+            received.append(time.perf_counter() - sent_at)
+        except asyncio.TimeoutError:
+            continue
+    monitor.cancel()
+
+
+async def awaited_stream(inbox: asyncio.Queue, received: list, stop: asyncio.Event):
+    while True:
+        sent_at = await inbox.get()
+        if sent_at is DONE:
+            break
+        received.append(time.perf_counter() - sent_at)
+
+
+async def run(stream, streams: int, idle: float, requests: int):
+    inboxes = [asyncio.Queue() for _ in range(streams)]
+    received = []
+    stop = asyncio.Event()
+    tasks = [asyncio.create_task(stream(q, received, stop)) for q in inboxes]
+
+    await asyncio.sleep(0.2)
+    cpu_start = time.process_time()
+    await asyncio.sleep(idle)
+    idle_cpu = time.process_time() - cpu_start
+
+    rng = random.Random(0)
+    for _ in range(requests):
+        await asyncio.sleep(rng.uniform(0.01, 0.05))
+        inboxes[rng.randrange(streams)].put_nowait(time.perf_counter())
+    await asyncio.sleep(0.3)
+
+    stop.set()
+    for q in inboxes:
+        q.put_nowait(DONE)
+    await asyncio.gather(*tasks)
+    return idle_cpu, received
+
+
+def report(name: str, idle: float, idle_cpu: float, latencies: list):
+    ms = sorted(x * 1000 for x in latencies)
+    p99 = ms[min(len(ms) - 1, int(len(ms) * 0.99))]
+    print(
+        f"{name:8s} idle CPU {idle_cpu / idle * 100:6.2f}%  "
+        f"permission-to-UI p50 {statistics.median(ms):7.2f} ms  p99 {p99:7.2f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--streams", type=int, default=200)
+    parser.add_argument("--idle", type=float, default=2.0)
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{args.streams} open streams, {args.idle}s idle, {args.requests} permission prompts")
+    for name, stream in (("polled", polled_stream), ("awaited", awaited_stream)):
+        idle_cpu, latencies = asyncio.run(run(stream, args.streams, args.idle, args.requests))
+        report(name, args.idle, idle_cpu, latencies)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+log = logging.getLogger(__name__)
+
+
+def options_key(fields: Dict[str, Any]) -> str:
+    blob = json.dumps(fields, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class PoolSlot:
+    """A connected SDK client plus the session it has been handed to, if any."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.client = None
+        self.owner = None
+        self.idle_since = time.monotonic()
+
+
+class ClientPool:
+    """Keeps already-connected clients per option set so /initialize skips the CLI spawn.
+
+    A key is only warmed after it has been checked out once; every checkout
+    schedules a background refill up to min_size idle clients for that key,
+    bounded by max_size idle clients in total. Clients idle for longer than
+    idle_ttl seconds are disconnected, and so are idle clients that alive()
+    reports dead when they are about to be handed out.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[PoolSlot, Dict[str, Any]], Awaitable[None]],
+        min_size: int = 1,
+        max_size: int = 4,
+        idle_ttl: float = 300.0,
+        alive: Callable[[PoolSlot], bool] = lambda slot: True,
+    ):
+        self.factory = factory
+        self.alive = alive
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.idle: Dict[str, List[PoolSlot]] = {}
+        self.specs: Dict[str, Dict[str, Any]] = {}
+        self.filling: Dict[str, int] = {}
+        self._tasks = set()
+        self._reaper: Optional[asyncio.Task] = None
+
+    def idle_count(self) -> int:
+        return sum(len(bucket) for bucket in self.idle.values())
+
+    async def acquire(self, fields: Dict[str, Any]) -> PoolSlot:
+        key = options_key(fields)
+        self.specs[key] = fields
+
+        bucket = self.idle.get(key)
+        slot = None
+        while bucket:
+            candidate = bucket.pop()
+            if self.alive(candidate):
+                slot = candidate
+                log.info("Pool hit", extra={"pool_key": key[:8]})
+                break
+            log.warning("Dropping dead pooled client", extra={"pool_key": key[:8]})
+            await self._disconnect(candidate)
+        if slot is None:
+            slot = PoolSlot(key)
+            await self.factory(slot, fields)
+
+        self._schedule_refill(key)
+        return slot
+
+    def _schedule_refill(self, key: str):
+        if self.min_size <= 0:
+            return
+        in_flight = sum(self.filling.values())
+        missing = self.min_size - len(self.idle.get(key, [])) - self.filling.get(key, 0)
+        room = self.max_size - self.idle_count() - in_flight
+        for _ in range(max(0, min(missing, room))):
+            self.filling[key] = self.filling.get(key, 0) + 1
+            task = asyncio.create_task(self._warm(key))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _warm(self, key: str):
+        slot = PoolSlot(key)
+        try:
+            await self.factory(slot, self.specs[key])
+        except asyncio.CancelledError:
+            # close() mid-connect; don't leave a half-started CLI behind
+            if slot.client is not None:
+                await self._disconnect(slot)
+            raise
+        except Exception as e:
+            log.warning("Pool warm-up failed: %s", e, extra={"pool_key": key[:8]})
+            return
+        finally:
+            self.filling[key] -= 1
+        slot.idle_since = time.monotonic()
+        self.idle.setdefault(key, []).append(slot)
+        log.info("Pool warmed client", extra={"pool_key": key[:8]})
+
+    async def _disconnect(self, slot: PoolSlot):
+        try:
+            await slot.client.disconnect()
+        except Exception as e:
+            log.warning("Error disconnecting pooled client: %s", e)
+
+    async def reap(self):
+        cutoff = time.monotonic() - self.idle_ttl
+        for key, bucket in list(self.idle.items()):
+            expired = [slot for slot in bucket if slot.idle_since < cutoff]
+            if not expired:
+                continue
+            self.idle[key] = [slot for slot in bucket if slot.idle_since >= cutoff]
+            for slot in expired:
+                await self._disconnect(slot)
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(max(1.0, self.idle_ttl / 2))
+            await self.reap()
+
+    def start(self):
+        if self._reaper is None and self.min_size > 0:
+            self._reaper = asyncio.create_task(self._reap_loop())
+
+    async def close(self):
+        if self._reaper:
+            self._reaper.cancel()
+            self._reaper = None
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for bucket in self.idle.values():
+            for slot in bucket:
+                await self._disconnect(slot)
+        self.idle.clear()
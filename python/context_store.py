@@ -0,0 +1,145 @@
+import hashlib
+import re
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+class ContextMissing(Exception):
+    """The client referenced document text the server no longer (or never) had."""
+
+    def __init__(self, content_hash: Optional[str], path: Optional[str] = None):
+        super().__init__(f"Context not in store: {content_hash}")
+        self.content_hash = content_hash
+        self.path = path
+
+
+def utf8_size(text: str) -> int:
+    return len(text.encode("utf-8"))
+
+
+class ContextStore:
+    """LRU of editor document text keyed by sha256, capped in total bytes."""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, str]" = OrderedDict()
+        self.size = 0
+
+    @staticmethod
+    def hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def put(self, text: str) -> str:
+        key = self.hash(text)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return key
+
+        self.entries[key] = text
+        self.size += utf8_size(text)
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= utf8_size(evicted)
+        return key
+
+    def get(self, key: Optional[str]) -> Optional[str]:
+        if not key or key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+
+def apply_unified_diff(base: str, diff: str) -> str:
+    """Apply a unified diff computed over base.split("\\n").
+
+    Matches difflib.unified_diff(old.split("\\n"), new.split("\\n"), lineterm="").
+    Raises ValueError when the diff does not apply cleanly.
+    """
+    source = base.split("\n")
+    lines = diff.split("\n")
+    if lines and lines[-1] == "":
+        lines.pop()
+
+    result = []
+    pos = 0
+    i = 0
+    while i < len(lines):
+        header = _HUNK_HEADER.match(lines[i])
+        i += 1
+        if not header:
+            continue
+
+        start = int(header.group(1))
+        count = int(header.group(2)) if header.group(2) is not None else 1
+        hunk_start = start - 1 if count > 0 else start
+        if hunk_start < pos or hunk_start > len(source):
+            raise ValueError(f"Hunk at line {start} is out of order or out of range")
+        result.extend(source[pos:hunk_start])
+        pos = hunk_start
+
+        while i < len(lines) and not lines[i].startswith("@@"):
+            line = lines[i]
+            i += 1
+            tag, text = line[:1], line[1:]
+            if tag == "+":
+                result.append(text)
+            elif tag in (" ", "-"):
+                if pos >= len(source) or source[pos] != text:
+                    raise ValueError(f"Diff does not match base at line {pos + 1}")
+                if tag == " ":
+                    result.append(text)
+                pos += 1
+            elif tag != "\\":
+                raise ValueError(f"Unexpected diff line: {line[:40]!r}")
+
+    result.extend(source[pos:])
+    return "\n".join(result)
+
+
+def resolve_context(
+    store: ContextStore, context: Dict[str, Any], last_hashes: Dict[str, str]
+) -> Dict[str, Any]:
+    """Fill in context["content"] from whichever form the client sent.
+
+    Accepts the full content, a content_hash of text sent earlier, or a
+    content_diff against base_hash (defaulting to the last version seen for
+    the same path). Raises ContextMissing when the referenced text is gone.
+    """
+    resolved = dict(context)
+    path = resolved.get("path")
+
+    if resolved.get("content") is not None:
+        content_hash = store.put(resolved["content"])
+
+    elif resolved.get("content_diff") is not None:
+        base_hash = resolved.get("base_hash") or (last_hashes.get(path) if path else None)
+        base = store.get(base_hash)
+        if base is None:
+            raise ContextMissing(base_hash, path)
+        try:
+            content = apply_unified_diff(base, resolved["content_diff"])
+        except ValueError:
+            raise ContextMissing(base_hash, path)
+        content_hash = store.put(content)
+        if resolved.get("content_hash") and resolved["content_hash"] != content_hash:
+            raise ContextMissing(resolved["content_hash"], path)
+        resolved["content"] = content
+
+    elif resolved.get("content_hash"):
+        content = store.get(resolved["content_hash"])
+        if content is None:
+            raise ContextMissing(resolved["content_hash"], path)
+        content_hash = resolved["content_hash"]
+        resolved["content"] = content
+
+    else:
+        return resolved
+
+    resolved.pop("content_diff", None)
+    resolved.pop("base_hash", None)
+    resolved["content_hash"] = content_hash
+    if path:
+        last_hashes[path] = content_hash
+    return resolved
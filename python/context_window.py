@@ -0,0 +1,186 @@
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# R assignments of function(), Python def, and JS-style function declarations
+_FUNCTION_DEF = re.compile(
+    r"^\s*(?:[\w.$]+\s*(?:<<-|<-|=)\s*function\b|(?:async\s+)?def\s+\w+|function\s+\w+)"
+)
+_PYTHON_DEF = re.compile(r"^\s*(?:async\s+)?def\s")
+_MAX_HEADER_LINES = 6
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token); cheap enough to run per query."""
+    return (len(text) + 3) // 4
+
+
+def selection_lines(selection: Optional[Dict[str, Any]]) -> Optional[Tuple[int, int]]:
+    """0-based (first, last) editor lines of an RStudio selection or cursor."""
+    if not selection or not selection.get("range"):
+        return None
+    try:
+        first = int(selection["range"]["start"]["line"]) - 1
+        last = int(selection["range"]["end"]["line"]) - 1
+    except (KeyError, TypeError, ValueError):
+        return None
+    return min(first, last), max(first, last)
+
+
+def _indent(line: str) -> int:
+    return len(line) - len(line.lstrip())
+
+
+def _block_end(lines: List[str], start: int) -> int:
+    if _PYTHON_DEF.match(lines[start]):
+        indent = _indent(lines[start])
+        end = start
+        for i in range(start + 1, len(lines)):
+            if lines[i].strip() and _indent(lines[i]) <= indent:
+                break
+            end = i
+        return end
+
+    depth = 0
+    opened = False
+    for i in range(start, len(lines)):
+        code = lines[i].split("#", 1)[0]
+        depth += code.count("{") - code.count("}")
+        opened = opened or "{" in code
+        if opened and depth <= 0:
+            return i
+        if not opened and i - start >= _MAX_HEADER_LINES:
+            # function(x) x + 1 -- a one-liner without braces
+            return start
+    return len(lines) - 1
+
+
+def _header(lines: List[str], start: int) -> List[int]:
+    for i in range(start, min(len(lines), start + _MAX_HEADER_LINES)):
+        code = lines[i].split("#", 1)[0].rstrip()
+        if "{" in code or code.endswith(":"):
+            return list(range(start, i + 1))
+    return [start]
+
+
+def enclosing_definitions(lines: List[str], line: int) -> List[int]:
+    """Start lines of every function definition whose body contains line."""
+    found = []
+    for i in range(min(line, len(lines) - 1), -1, -1):
+        if _FUNCTION_DEF.match(lines[i]) and _block_end(lines, i) >= line:
+            found.append(i)
+    return found
+
+
+def window_content(
+    content: str, anchor: Optional[Tuple[int, int]], budget: int
+) -> Tuple[str, Dict[str, Any]]:
+    """Trim content to about budget tokens around anchor, marking omitted lines.
+
+    The anchor lines and the headers of their enclosing functions are always
+    kept; the window then grows outwards one line at a time on both sides.
+    Without an anchor the window grows from the top of the file.
+    """
+    lines = content.split("\n")
+    full_tokens = estimate_tokens(content)
+    stats = {
+        "context_tokens_full": full_tokens,
+        "lines_total": len(lines),
+    }
+    if full_tokens <= budget:
+        stats.update(context_tokens=full_tokens, lines_kept=len(lines), trimmed=False)
+        return content, stats
+
+    keep = set()
+    used = 0
+
+    def cost(i: int) -> int:
+        return estimate_tokens(lines[i]) + 1
+
+    def take(i: int):
+        nonlocal used
+        if i not in keep:
+            keep.add(i)
+            used += cost(i)
+
+    if anchor:
+        first = max(0, min(anchor[0], len(lines) - 1))
+        last = max(first, min(anchor[1], len(lines) - 1))
+        for i in range(first, last + 1):
+            take(i)
+        for start in enclosing_definitions(lines, first):
+            for i in _header(lines, start):
+                take(i)
+        below, above = first - 1, last + 1
+    else:
+        below, above = -1, 0
+
+    while below >= 0 or above < len(lines):
+        grew = False
+        for side in ("above", "below"):
+            i = above if side == "above" else below
+            if not 0 <= i < len(lines):
+                continue
+            if i not in keep and used + cost(i) > budget:
+                continue
+            take(i)
+            grew = True
+            if side == "above":
+                above += 1
+            else:
+                below -= 1
+        if not grew:
+            break
+
+    out = []
+    gap_start = None
+    for i, line in enumerate(lines + [None]):
+        if i < len(lines) and i not in keep:
+            if gap_start is None:
+                gap_start = i
+            continue
+        if gap_start is not None:
+            out.append(f"... [lines {gap_start + 1}-{i} omitted] ...")
+            gap_start = None
+        if line is not None:
+            out.append(line)
+
+    windowed = "\n".join(out)
+    stats.update(
+        context_tokens=estimate_tokens(windowed), lines_kept=len(keep), trimmed=True
+    )
+    return windowed, stats
+
+
+def build_prompt(
+    prompt: str, context: Optional[Dict[str, Any]], budget: int
+) -> Tuple[str, Dict[str, Any]]:
+    """The message sent for one query, with editor context ahead of the question.
+
+    Material that rarely changes between turns (the file path, then its
+    content) comes first and what changes every turn (the selection, then
+    the question) last. Consecutive prompts about the same file therefore
+    share the longest possible prefix, which is what the API's prompt
+    cache can reuse.
+    """
+    stats: Dict[str, Any] = {}
+    if not context:
+        return prompt, stats
+
+    stable = []
+    if context.get("path"):
+        stable.append(f"Current file: {context['path']}")
+    selection = context.get("selection") or {}
+    if context.get("content"):
+        content, stats = window_content(context["content"], selection_lines(selection), budget)
+        label = "File content (excerpt)" if stats["trimmed"] else "File content"
+        stable.append(f"{label}:\n```\n{content}\n```")
+
+    volatile = []
+    if selection.get("text"):
+        volatile.append(f"Selected code:\n```\n{selection['text']}\n```")
+    if not stable and not volatile:
+        return prompt, stats
+
+    if stable:
+        stats["stable_prefix_tokens"] = estimate_tokens("\n\n".join(stable))
+    return "\n\n".join(stable + volatile + [prompt]), stats
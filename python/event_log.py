@@ -0,0 +1,94 @@
+import asyncio
+import time
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, Tuple
+
+# (seq, event, data, ts)
+Entry = Tuple[int, str, bytes, float]
+
+
+class EventsExpired(Exception):
+    """A reader asked to resume from events the buffer has already dropped."""
+
+    def __init__(self, after: int, first_seq: int):
+        super().__init__(f"Events after {after} are gone; the buffer starts at {first_seq}")
+        self.after = after
+        self.first_seq = first_seq
+
+
+class EventLog:
+    """One query's events, numbered from 1, in a ring buffer capped in bytes.
+
+    The query appends as it runs whether or not anyone is reading, so a
+    client whose stream dropped can follow() again from the last seq it saw.
+    The cap only applies to events every attached reader has already seen:
+    a slow reader holds the buffer open rather than losing its stream. The
+    newest event is always kept, even when it alone exceeds max_bytes.
+    """
+
+    def __init__(self, query_id: str, max_bytes: int = 4 * 1024 * 1024):
+        self.query_id = query_id
+        self.max_bytes = max_bytes
+        self.entries: Deque[Entry] = deque()
+        self.size = 0
+        self.next_seq = 1
+        self.closed = False
+        # Streams currently following this log
+        self.followers = 0
+        # Last seq handed to each active follow() generator
+        self._cursors: Dict[int, int] = {}
+        self._next_cursor = 0
+        self._changed = asyncio.Event()
+
+    def _wake(self):
+        # Readers wait on the old event; later appends need a fresh one
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def append(self, event: str, data: bytes) -> int:
+        seq = self.next_seq
+        self.next_seq += 1
+        self.entries.append((seq, event, data, time.time()))
+        self.size += len(data)
+        self._trim()
+        self._wake()
+        return seq
+
+    def _trim(self):
+        consumed = min(self._cursors.values(), default=self.next_seq)
+        while (
+            self.size > self.max_bytes
+            and len(self.entries) > 1
+            and self.entries[0][0] <= consumed
+        ):
+            self.size -= len(self.entries.popleft()[2])
+
+    def close(self):
+        self.closed = True
+        self._wake()
+
+    @property
+    def first_seq(self) -> int:
+        return self.entries[0][0] if self.entries else self.next_seq
+
+    async def follow(self, after: int = 0) -> AsyncIterator[Entry]:
+        """Yield events with seq > after, then new ones as they come, until closed."""
+        if after + 1 < self.first_seq:
+            raise EventsExpired(after, self.first_seq)
+        last = after
+        cursor = self._next_cursor
+        self._next_cursor += 1
+        self._cursors[cursor] = last
+        try:
+            while True:
+                changed = self._changed
+                while self.entries and last < self.entries[-1][0]:
+                    entry = self.entries[last + 1 - self.entries[0][0]]
+                    last = self._cursors[cursor] = entry[0]
+                    yield entry
+                if self.closed:
+                    return
+                await changed.wait()
+        finally:
+            del self._cursors[cursor]
+            self._trim()
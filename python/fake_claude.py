@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""Stand-in for the `claude` CLI that speaks the SDK's stream-json protocol.
+
+Point the server at it with CLAUDE_CLI_PATH=/path/to/fake_claude.py (or pass
+cli_path= to ClaudeAgentOptions) to exercise initialize -> query -> approve
+-> shutdown, including subprocess startup, without a network or credentials.
+
+Each user message starts a turn. A turn replays the next slice of the
+transcript, up to and including its result line, and wraps around at the
+end. Without a transcript the turn is a Write tool call followed by an echo
+of the prompt. Transcript lines are the stream-json messages the real CLI
+prints, i.e. the type user/assistant/result/stream_event objects. Two
+directives are also understood:
+
+    {"type": "fake_delay", "ms": 250}
+    {"type": "fake_crash", "exit_code": 1}
+
+Tool calls for tools in FAKE_CLAUDE_PERMISSION_TOOLS go through a
+can_use_tool control request first. A denied call replays as an error
+tool_result.
+
+Environment:
+    FAKE_CLAUDE_TRANSCRIPT       JSONL transcript to replay
+    FAKE_CLAUDE_STARTUP_MS       sleep before serving, like CLI boot time
+    FAKE_CLAUDE_FIRST_MS         delay before the first message of a turn
+    FAKE_CLAUDE_DELAY_MS         delay between messages
+    FAKE_CLAUDE_PERMISSION_TOOLS comma-separated (default Write,Edit,Bash)
+    FAKE_CLAUDE_CRASH_AFTER      exit after writing this many messages
+    FAKE_CLAUDE_EXIT_CODE        exit code for crashes (default 1)
+"""
+import argparse
+import copy
+import itertools
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterator, List, Optional
+
+VERSION = "2.1.999 (fake)"
+
+
+def env_ms(name: str) -> float:
+    return float(os.environ.get(name, 0)) / 1000
+
+
+class Output:
+    """Serialised writer for stdout; counts messages for crash injection."""
+
+    def __init__(self, crash_after: Optional[int], exit_code: int):
+        self.lock = threading.Lock()
+        self.written = 0
+        self.crash_after = crash_after
+        self.exit_code = exit_code
+
+    def write(self, message: Dict[str, Any], counted: bool = True):
+        with self.lock:
+            sys.stdout.write(json.dumps(message) + "\n")
+            sys.stdout.flush()
+            if not counted:
+                return
+            self.written += 1
+            if self.crash_after is not None and self.written >= self.crash_after:
+                crash(self.exit_code, f"crash injected after {self.written} messages")
+
+
+def crash(exit_code: int, reason: str):
+    sys.stderr.write(f"fake_claude: {reason}\n")
+    sys.stderr.flush()
+    os._exit(exit_code)
+
+
+def default_turn(prompt: str) -> List[Dict[str, Any]]:
+    tool_id = f"toolu_{uuid.uuid4().hex[:12]}"
+    return [
+        {
+            "type": "assistant",
+            "message": {
+                "role": "assistant",
+                "model": "fake",
+                "content": [
+                    {
+                        "type": "tool_use",
+                        "id": tool_id,
+                        "name": "Write",
+                        "input": {"file_path": "fake_output.txt", "content": prompt},
+                    }
+                ],
+            },
+        },
+        {
+            "type": "user",
+            "message": {
+                "role": "user",
+                "content": [
+                    {"type": "tool_result", "tool_use_id": tool_id, "content": "File written"}
+                ],
+            },
+        },
+        {
+            "type": "assistant",
+            "message": {
+                "role": "assistant",
+                "model": "fake",
+                "content": [{"type": "text", "text": f"Echo: {prompt}"}],
+            },
+        },
+        {
+            "type": "result",
+            "subtype": "success",
+            "is_error": False,
+            "num_turns": 2,
+            "total_cost_usd": 0.0,
+            "usage": {"input_tokens": len(prompt) // 4, "output_tokens": 8},
+            "result": f"Echo: {prompt}",
+        },
+    ]
+
+
+def load_turns(path: str) -> List[List[Dict[str, Any]]]:
+    turns, current = [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            message = json.loads(line)
+            if message.get("type") in ("system", "control_request", "control_response"):
+                continue
+            current.append(message)
+            if message.get("type") == "result":
+                turns.append(current)
+                current = []
+    if current:
+        turns.append(current)
+    if not turns:
+        raise SystemExit(f"fake_claude: no messages in {path}")
+    return turns
+
+
+def text_deltas(text: str, session_id: str) -> Iterator[Dict[str, Any]]:
+    for start in range(0, len(text), 16):
+        yield {
+            "type": "stream_event",
+            "uuid": uuid.uuid4().hex,
+            "session_id": session_id,
+            "event": {
+                "type": "content_block_delta",
+                "index": 0,
+                "delta": {"type": "text_delta", "text": text[start : start + 16]},
+            },
+        }
+
+
+class FakeCLI:
+    def __init__(self, args):
+        self.args = args
+        self.session_id = args.resume or args.session_id or str(uuid.uuid4())
+        self.output = Output(
+            int(os.environ["FAKE_CLAUDE_CRASH_AFTER"])
+            if os.environ.get("FAKE_CLAUDE_CRASH_AFTER")
+            else None,
+            int(os.environ.get("FAKE_CLAUDE_EXIT_CODE", 1)),
+        )
+        self.permission_tools = {
+            name.strip()
+            for name in os.environ.get("FAKE_CLAUDE_PERMISSION_TOOLS", "Write,Edit,Bash").split(",")
+            if name.strip()
+        }
+        if args.permission_mode == "bypassPermissions":
+            self.permission_tools = set()
+        transcript = os.environ.get("FAKE_CLAUDE_TRANSCRIPT")
+        self.turns = itertools.cycle(load_turns(transcript)) if transcript else None
+        self.delay = env_ms("FAKE_CLAUDE_DELAY_MS")
+        self.first_delay = env_ms("FAKE_CLAUDE_FIRST_MS")
+
+        self.prompts: "queue.Queue[Optional[str]]" = queue.Queue()
+        self.responses: Dict[str, Dict[str, Any]] = {}
+        self.response_ready = threading.Condition()
+        self.interrupted = threading.Event()
+        self.request_ids = itertools.count(1)
+
+    # stdin, on its own thread so control traffic flows while a turn runs
+
+    def read_stdin(self):
+        for line in sys.stdin:
+            line = line.strip()
+            if not line:
+                continue
+            message = json.loads(line)
+            kind = message.get("type")
+            if kind == "user":
+                self.prompts.put(prompt_text(message))
+            elif kind == "control_request":
+                self.handle_control_request(message)
+            elif kind == "control_response":
+                response = message["response"]
+                with self.response_ready:
+                    self.responses[response["request_id"]] = response
+                    self.response_ready.notify_all()
+        self.prompts.put(None)
+
+    def handle_control_request(self, message: Dict[str, Any]):
+        request = message["request"]
+        subtype = request.get("subtype")
+        if subtype == "initialize":
+            body = {"commands": [], "output_style": "default", "models": []}
+        elif subtype == "interrupt":
+            self.interrupted.set()
+            body = {}
+        elif subtype == "mcp_status":
+            body = {"mcpServers": []}
+        else:
+            body = {}
+        self.output.write(
+            {
+                "type": "control_response",
+                "response": {
+                    "subtype": "success",
+                    "request_id": message["request_id"],
+                    "response": body,
+                },
+            },
+            counted=False,
+        )
+
+    def ask_permission(self, block: Dict[str, Any]) -> str:
+        request_id = f"fake_perm_{next(self.request_ids)}"
+        self.output.write(
+            {
+                "type": "control_request",
+                "request_id": request_id,
+                "request": {
+                    "subtype": "can_use_tool",
+                    "tool_name": block["name"],
+                    "input": block.get("input", {}),
+                    "tool_use_id": block.get("id"),
+                    "permission_suggestions": [],
+                },
+            },
+            counted=False,
+        )
+        return request_id
+
+    def await_permission(self, request_id: str) -> Dict[str, Any]:
+        with self.response_ready:
+            while request_id not in self.responses:
+                self.response_ready.wait()
+            response = self.responses.pop(request_id)
+        if response.get("subtype") == "error":
+            return {"behavior": "deny", "message": response.get("error", "")}
+        return response.get("response", {})
+
+    # turns
+
+    def send(self, message: Dict[str, Any]):
+        message.setdefault("session_id", self.session_id)
+        if self.args.include_partial_messages and message.get("type") == "assistant":
+            for block in message["message"]["content"]:
+                if block.get("type") == "text":
+                    for delta in text_deltas(block["text"], self.session_id):
+                        self.output.write(delta)
+        self.output.write(message)
+
+    def run_turn(self, prompt: str):
+        started = time.monotonic()
+        self.interrupted.clear()
+        self.output.write(
+            {
+                "type": "system",
+                "subtype": "init",
+                "session_id": self.session_id,
+                "cwd": os.getcwd(),
+                "model": self.args.model or "fake",
+                "permissionMode": self.args.permission_mode or "default",
+                "tools": sorted(self.permission_tools | {"Read", "Glob", "Grep"}),
+            }
+        )
+        messages = next(self.turns) if self.turns else default_turn(prompt)
+        denied = set()
+        if self.first_delay:
+            time.sleep(self.first_delay)
+
+        for i, message in enumerate(messages):
+            message = copy.deepcopy(message)
+            kind = message.get("type")
+            if self.interrupted.is_set():
+                self.finish(started, interrupted=True)
+                return
+            if kind == "fake_delay":
+                time.sleep(message.get("ms", 0) / 1000)
+                continue
+            if kind == "fake_crash":
+                crash(message.get("exit_code", 1), "crash directive in transcript")
+            if kind == "result":
+                self.finish(started, message)
+                return
+            if i and self.delay:
+                time.sleep(self.delay)
+
+            if kind == "assistant":
+                # Like the real CLI, print the tool calls before asking about
+                # them, and ask about parallel calls all at once
+                self.send(message)
+                asked = [
+                    (block.get("id"), self.ask_permission(block))
+                    for block in message["message"].get("content", [])
+                    if block.get("type") == "tool_use" and block.get("name") in self.permission_tools
+                ]
+                for tool_id, request_id in asked:
+                    if self.await_permission(request_id).get("behavior") != "allow":
+                        denied.add(tool_id)
+            elif kind == "user" and denied:
+                content = message["message"].get("content")
+                if isinstance(content, list):
+                    for block in content:
+                        if block.get("type") == "tool_result" and block.get("tool_use_id") in denied:
+                            block["content"] = "Permission denied by user"
+                            block["is_error"] = True
+                self.send(message)
+            else:
+                self.send(message)
+
+        self.finish(started)
+
+    def finish(self, started: float, result: Optional[Dict[str, Any]] = None, interrupted=False):
+        elapsed_ms = int((time.monotonic() - started) * 1000)
+        message = {
+            "type": "result",
+            "subtype": "error_during_execution" if interrupted else "success",
+            "is_error": interrupted,
+            "num_turns": 1,
+            "total_cost_usd": 0.0,
+            "usage": {"input_tokens": 0, "output_tokens": 0},
+        }
+        message.update(result or {})
+        message.update(
+            {"session_id": self.session_id, "duration_ms": elapsed_ms, "duration_api_ms": elapsed_ms}
+        )
+        self.output.write(message)
+
+    def serve(self):
+        time.sleep(env_ms("FAKE_CLAUDE_STARTUP_MS"))
+        threading.Thread(target=self.read_stdin, daemon=True).start()
+        while True:
+            prompt = self.prompts.get()
+            if prompt is None:
+                return
+            self.run_turn(prompt)
+
+
+def prompt_text(message: Dict[str, Any]) -> str:
+    content = message.get("message", {}).get("content", "")
+    if isinstance(content, list):
+        return "\n".join(block.get("text", "") for block in content if isinstance(block, dict))
+    return content
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("-v", "--version", action="store_true")
+    parser.add_argument("--model")
+    parser.add_argument("--permission-mode")
+    parser.add_argument("--resume")
+    parser.add_argument("--session-id")
+    parser.add_argument("--include-partial-messages", action="store_true")
+    # Everything else the SDK passes (--output-format, --setting-sources, ...)
+    # is accepted and ignored
+    args, _ = parser.parse_known_args(argv)
+
+    if args.version:
+        print(VERSION)
+        return
+    FakeCLI(args).serve()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+"""Simulate many RStudio clients against a running sdk_server.
+
+Each simulated client does what R/sdk_client.R does. It calls /initialize,
+then streams /query, answering every permission_request through /approve
+after a sampled think time. Some streams are dropped early at random, and
+the client calls /shutdown at the end. Server memory is sampled from
+/metrics while the run is in progress.
+
+Against a server already running:
+
+    python loadgen.py --url http://127.0.0.1:8765 --clients 20 --duration 60
+
+Or let loadgen start one backed by fake_claude.py (no network, no credentials):
+
+    python loadgen.py --spawn-server --clients 20 --duration 60 --json-out run.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+HERE = Path(__file__).resolve().parent
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))] * 1000, 2)
+
+    return {"p50": pick(50), "p90": pick(90), "p99": pick(99), "max": pick(100)}
+
+
+class Stats:
+    def __init__(self):
+        self.timings: Dict[str, List[float]] = {
+            "initialize": [],
+            "first_event": [],
+            "query": [],
+            "approve": [],
+        }
+        self.counts = Counter()
+        self.events = Counter()
+        self.errors = Counter()
+        self.memory: List[Dict[str, float]] = []
+
+    def summary(self, elapsed: float) -> Dict:
+        queries = self.counts["queries_completed"] + self.counts["queries_abandoned"]
+        failed = self.counts["queries_failed"]
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "counts": dict(self.counts),
+            "throughput": {
+                "queries_per_sec": round(self.counts["queries_completed"] / elapsed, 2),
+                "events_per_sec": round(sum(self.events.values()) / elapsed, 1),
+            },
+            "error_rate": round(failed / (queries + failed), 4) if queries + failed else 0.0,
+            "errors": dict(self.errors),
+            "events": dict(self.events),
+            "latency_ms": {name: percentiles(values) for name, values in self.timings.items()},
+            "server_memory_mb": self.memory,
+        }
+
+
+class SimulatedClient:
+    def __init__(self, index: int, http: httpx.AsyncClient, stats: Stats, args):
+        self.index = index
+        self.http = http
+        self.stats = stats
+        self.args = args
+        self.rng = random.Random(args.seed + index)
+        self.headers: Dict[str, str] = {}
+        self.approvals: List[asyncio.Task] = []
+
+    def think_time(self) -> float:
+        mean = self.args.think_ms / 1000
+        if self.args.think_dist == "fixed":
+            return mean
+        if self.args.think_dist == "uniform":
+            return self.rng.uniform(0, 2 * mean)
+        return self.rng.expovariate(1 / mean) if mean > 0 else 0.0
+
+    async def initialize(self) -> bool:
+        started = time.perf_counter()
+        try:
+            resp = await self.http.post(
+                "/initialize",
+                json={
+                    "working_dir": self.args.working_dir,
+                    "auth_method": "subscription",
+                    "stream_partial": self.args.stream_partial,
+                },
+            )
+            resp.raise_for_status()
+        except httpx.HTTPError as e:
+            self.stats.errors[f"initialize:{type(e).__name__}"] += 1
+            return False
+        self.stats.timings["initialize"].append(time.perf_counter() - started)
+        self.headers = {"X-Session-Token": resp.json()["session_token"]}
+        return True
+
+    async def approve(self, request_id: str):
+        await asyncio.sleep(self.think_time())
+        approved = self.rng.random() >= self.args.deny_rate
+        started = time.perf_counter()
+        try:
+            resp = await self.http.post(
+                "/approve",
+                json={"request_id": request_id, "approved": approved},
+                headers=self.headers,
+            )
+            resp.raise_for_status()
+        except httpx.HTTPError as e:
+            self.stats.errors[f"approve:{type(e).__name__}"] += 1
+            return
+        self.stats.timings["approve"].append(time.perf_counter() - started)
+        self.stats.counts["approved" if approved else "denied"] += 1
+
+    async def query(self, n: int):
+        drop_after = None
+        if self.rng.random() < self.args.disconnect_rate:
+            drop_after = self.rng.randint(1, 10)
+
+        started = time.perf_counter()
+        first = True
+        seen = 0
+        event = None
+        try:
+            async with self.http.stream(
+                "POST",
+                "/query",
+                json={"prompt": f"load test prompt {self.index}-{n}"},
+                headers=self.headers,
+            ) as resp:
+                resp.raise_for_status()
+                async for line in resp.aiter_lines():
+                    if line.startswith("event:"):
+                        event = line[6:].strip()
+                        continue
+                    if not line.startswith("data:") or event is None:
+                        continue
+                    if first:
+                        self.stats.timings["first_event"].append(time.perf_counter() - started)
+                        first = False
+                    data = json.loads(line[5:])
+                    seen += 1
+                    if event == "batch":
+                        self.stats.events[data["type"]] += len(data["events"])
+                    else:
+                        self.stats.events[event] += 1
+                    if event == "permission_request":
+                        self.approvals.append(
+                            asyncio.create_task(self.approve(data["request_id"]))
+                        )
+                    elif event == "error":
+                        self.stats.errors[f"event:{data.get('error_type')}"] += 1
+                    if drop_after is not None and seen >= drop_after:
+                        self.stats.counts["queries_abandoned"] += 1
+                        return
+        except httpx.HTTPError as e:
+            self.stats.errors[f"query:{type(e).__name__}"] += 1
+            self.stats.counts["queries_failed"] += 1
+            return
+        self.stats.timings["query"].append(time.perf_counter() - started)
+        self.stats.counts["queries_completed"] += 1
+
+    async def run(self, deadline: float):
+        await asyncio.sleep(self.rng.uniform(0, self.args.ramp_up))
+        if not await self.initialize():
+            return
+        n = 0
+        while time.monotonic() < deadline:
+            try:
+                await asyncio.wait_for(self.query(n), self.args.query_timeout)
+            except asyncio.TimeoutError:
+                self.stats.errors["query:timeout"] += 1
+                self.stats.counts["queries_failed"] += 1
+            n += 1
+            if self.args.queries and n >= self.args.queries:
+                break
+            await asyncio.sleep(self.think_time())
+        if self.approvals:
+            await asyncio.gather(*self.approvals, return_exceptions=True)
+        try:
+            await self.http.post("/shutdown", headers=self.headers)
+        except httpx.HTTPError as e:
+            self.stats.errors[f"shutdown:{type(e).__name__}"] += 1
+
+
+async def sample_memory(http: httpx.AsyncClient, stats: Stats, interval: float, started: float):
+    while True:
+        try:
+            resp = await http.get("/metrics")
+            for line in resp.text.splitlines():
+                if line.startswith("process_resident_memory_bytes "):
+                    stats.memory.append(
+                        {
+                            "t": round(time.monotonic() - started, 1),
+                            "rss_mb": round(float(line.split()[1]) / 1024 / 1024, 1),
+                        }
+                    )
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(interval)
+
+
+async def report_progress(stats: Stats, interval: float, started: float):
+    while True:
+        await asyncio.sleep(interval)
+        elapsed = time.monotonic() - started
+        rss = stats.memory[-1]["rss_mb"] if stats.memory else "?"
+        print(
+            f"[{elapsed:6.1f}s] completed={stats.counts['queries_completed']}"
+            f" abandoned={stats.counts['queries_abandoned']}"
+            f" failed={stats.counts['queries_failed']}"
+            f" events={sum(stats.events.values())} rss_mb={rss}",
+            file=sys.stderr,
+        )
+
+
+def spawn_server(port: int, extra_env: Dict[str, str]) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "PORT": str(port),
+        "CLAUDE_CLI_PATH": str(HERE / "fake_claude.py"),
+        "CLAUDE_LOG_LEVEL": "WARNING",
+        # Fake conversations have no business in the real session store
+        "CLAUDE_SESSION_STORE": "",
+        **extra_env,
+    }
+    return subprocess.Popen([sys.executable, str(HERE / "sdk_server.py")], env=env)
+
+
+async def wait_for_server(http: httpx.AsyncClient, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            await http.get("/health")
+            return
+        except httpx.HTTPError:
+            await asyncio.sleep(0.2)
+    raise SystemExit("Server did not come up")
+
+
+async def run(args) -> Dict:
+    limits = httpx.Limits(max_connections=args.clients * 2 + 4)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as http:
+        await wait_for_server(http)
+        stats = Stats()
+        started = time.monotonic()
+        background = [
+            asyncio.create_task(sample_memory(http, stats, args.sample_interval, started)),
+            asyncio.create_task(report_progress(stats, args.report_interval, started)),
+        ]
+        deadline = started + args.duration
+        clients = [SimulatedClient(i, http, stats, args) for i in range(args.clients)]
+        await asyncio.gather(*(client.run(deadline) for client in clients))
+        elapsed = time.monotonic() - started
+        for task in background:
+            task.cancel()
+        return stats.summary(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8765")
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--queries", type=int, default=0, help="per client; 0 = until --duration")
+    parser.add_argument("--ramp-up", type=float, default=2.0)
+    parser.add_argument("--think-ms", type=float, default=500.0)
+    parser.add_argument("--think-dist", choices=("exp", "uniform", "fixed"), default="exp")
+    parser.add_argument("--deny-rate", type=float, default=0.1)
+    parser.add_argument("--disconnect-rate", type=float, default=0.05)
+    parser.add_argument("--stream-partial", action="store_true")
+    parser.add_argument("--working-dir", default=os.getcwd())
+    parser.add_argument("--timeout", type=float, default=120.0, help="per HTTP read")
+    parser.add_argument("--query-timeout", type=float, default=60.0)
+    parser.add_argument("--sample-interval", type=float, default=1.0)
+    parser.add_argument("--report-interval", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json-out", type=Path)
+    parser.add_argument(
+        "--spawn-server",
+        action="store_true",
+        help="start sdk_server.py on --url's port with CLAUDE_CLI_PATH=fake_claude.py",
+    )
+    args = parser.parse_args()
+
+    server: Optional[subprocess.Popen] = None
+    if args.spawn_server:
+        server = spawn_server(httpx.URL(args.url).port or 8765, {})
+    try:
+        summary = asyncio.run(run(args))
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=10)
+
+    print(json.dumps(summary, indent=2))
+    if args.json_out:
+        args.json_out.write_text(json.dumps(summary, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Tools that only look at things. A turn that used anything else (including
+# MCP and unknown tools) may have changed the project and is never cached.
+READ_ONLY_TOOLS = frozenset(
+    {"Read", "Glob", "Grep", "LS", "NotebookRead", "WebFetch", "WebSearch"}
+)
+
+# (event, encoded data) frames as they went out on the wire
+Frames = List[Tuple[str, bytes]]
+
+
+def normalize_prompt(prompt: str) -> str:
+    return re.sub(r"\s+", " ", prompt).strip().casefold()
+
+
+def cache_key(
+    model: Optional[str],
+    system_prompt: Optional[str],
+    working_dir: Optional[str],
+    prompt: str,
+    context: Optional[Dict[str, Any]],
+) -> str:
+    """Hash of everything that shapes a read-only answer except the files themselves.
+
+    context is the resolved editor context, so an edited file changes the key.
+    """
+    context_hash = (
+        hashlib.sha256(json.dumps(context, sort_keys=True).encode("utf-8")).hexdigest()
+        if context
+        else None
+    )
+    material = [model, system_prompt, working_dir, normalize_prompt(prompt), context_hash]
+    return hashlib.sha256(json.dumps(material).encode("utf-8")).hexdigest()
+
+
+def cacheable_turn(tools_used: Sequence[str]) -> bool:
+    return all(name in READ_ONLY_TOOLS for name in tools_used)
+
+
+# What the original turn spent and where it ran; a replay spent nothing
+SPENDING_FIELDS = ("usage", "prompt_cache", "session_id")
+
+
+def mark_cached(data: bytes) -> bytes:
+    """A cached result event as a replay reports it: flagged, and free."""
+    result = json.loads(data)
+    for field in SPENDING_FIELDS:
+        result.pop(field, None)
+    if "total_cost_usd" in result:
+        result["total_cost_usd"] = 0.0
+    result["cached"] = True
+    return json.dumps(result).encode("utf-8")
+
+
+class ResponseCache:
+    """LRU of replayable query event sequences, capped in bytes, with a TTL."""
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, ttl: float = 600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, Tuple[float, int, Frames]]" = OrderedDict()
+        self.size = 0
+
+    def get(self, key: str) -> Optional[Frames]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, _, frames = entry
+        if expires < time.monotonic():
+            self._drop(key)
+            return None
+        self.entries.move_to_end(key)
+        return frames
+
+    def put(self, key: str, frames: Frames) -> bool:
+        size = sum(len(data) for _, data in frames)
+        if size > self.max_bytes:
+            return False
+        if key in self.entries:
+            self._drop(key)
+        self.entries[key] = (time.monotonic() + self.ttl, size, frames)
+        self.size += size
+        while self.size > self.max_bytes:
+            self._drop(next(iter(self.entries)))
+        return True
+
+    def _drop(self, key: str):
+        _, size, _ = self.entries.pop(key)
+        self.size -= size
@@ -2,13 +2,17 @@
 import os
 import sys
 import asyncio
-import json
+import logging
+import secrets
+import time
+from functools import partial
 from pathlib import Path
-from typing import Optional, Dict, Any, List
-from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, List, AsyncIterator, Tuple
+from collections import OrderedDict
+from contextlib import asynccontextmanager, suppress
 
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, HTTPException, Request, Header
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from pydantic import BaseModel
 from sse_starlette.sse import EventSourceResponse
 import uvicorn
@@ -34,15 +38,134 @@ except ImportError as e:
     )
     sys.exit(1)
 
+from client_pool import ClientPool, PoolSlot, options_key
+from context_store import ContextMissing, ContextStore, resolve_context
+from context_window import build_prompt, estimate_tokens
+from event_batching import coalesce_events, coalesce_frames
+from event_log import EventLog, EventsExpired
+from serializer import dumps, encode, ndjson_line, sse_frame
+from message_recorder import Recorder, ReplayClient
+from metrics import REGISTRY, resident_memory_bytes
+from permission_policy import REMEMBER_SCOPES, PermissionPolicy
+from query_scheduler import QueryScheduler, QueueFull, Ticket
+from response_cache import ResponseCache, cache_key, cacheable_turn, mark_cached
+from server_logging import setup_logging
+from session_store import RESUMABLE_OPTIONS, SessionStore
+from tracing import Trace, annotate, exporter_from_env
+
+log = logging.getLogger("sdk_server")
+
+# Forwarding the CLI's --debug-to-stderr output costs a stderr line per CLI event
+SDK_DEBUG = os.environ.get("CLAUDE_SDK_DEBUG", "") not in ("", "0", "false")
+
+# Overrides the bundled/PATH claude binary, e.g. with fake_claude.py for offline runs
+CLI_PATH = os.environ.get("CLAUDE_CLI_PATH")
+
+# Record every query's SDK messages as fixtures, or serve fixtures instead of the SDK
+RECORD_DIR = os.environ.get("CLAUDE_RECORD_DIR")
+REPLAY_FIXTURES = os.environ.get("CLAUDE_REPLAY_FIXTURES")
+REPLAY_SPEED = float(os.environ.get("CLAUDE_REPLAY_SPEED", 1.0))
+
+# A permission request nobody answers is settled with the timeout action
+# after this many seconds (0 waits forever); /initialize can override both
+PERMISSION_TIMEOUT = float(os.environ.get("CLAUDE_PERMISSION_TIMEOUT", 600))
+PERMISSION_TIMEOUT_ACTION = os.environ.get("CLAUDE_PERMISSION_TIMEOUT_ACTION", "deny")
+MAX_PENDING_PERMISSIONS = int(os.environ.get("CLAUDE_MAX_PENDING_PERMISSIONS", 32))
+TIMEOUT_ACTIONS = ("allow", "deny")
+
+# Every query's events are kept in a ring buffer of this size so a dropped
+# stream can resume with GET /query/{id}/events. The last RESUME_QUERIES
+# logs per session stay available; a turn nobody follows for RESUME_GRACE
+# seconds has its pending permissions denied.
+EVENT_LOG_BYTES = int(float(os.environ.get("CLAUDE_EVENT_LOG_MB", 4)) * 1024 * 1024)
+RESUME_QUERIES = int(os.environ.get("CLAUDE_RESUME_QUERIES", 4))
+RESUME_GRACE = float(os.environ.get("CLAUDE_RESUME_GRACE", 30))
+# What happens to a turn once the grace period passes with no reader:
+# "continue" lets it finish (still resumable), "interrupt" stops it
+DISCONNECT_POLICIES = ("continue", "interrupt")
+DISCONNECT_POLICY = os.environ.get("CLAUDE_DISCONNECT_POLICY", "continue")
+
+# A session runs one query at a time with up to CLAUDE_QUERY_QUEUE_SIZE more
+# waiting (429 beyond that); CLAUDE_MAX_RUNNING_QUERIES caps the server
+# (0 = no cap) and hands out slots to sessions in turn
+scheduler = QueryScheduler(
+    max_waiting=int(os.environ.get("CLAUDE_QUERY_QUEUE_SIZE", 4)),
+    max_running=int(os.environ.get("CLAUDE_MAX_RUNNING_QUERIES", 0)),
+)
+
+# Opt-in replay of read-only answers: CLAUDE_RESPONSE_CACHE=1 turns it on for
+# every query, or a query asks with "cache": true
+RESPONSE_CACHE_DEFAULT = os.environ.get("CLAUDE_RESPONSE_CACHE", "") not in ("", "0", "false")
+response_cache = ResponseCache(
+    max_bytes=int(float(os.environ.get("CLAUDE_RESPONSE_CACHE_MB", 32)) * 1024 * 1024),
+    ttl=float(os.environ.get("CLAUDE_RESPONSE_CACHE_TTL", 600)),
+)
+# Seeing any of these means a person was involved; such turns aren't replayed
+UNCACHEABLE_EVENTS = {
+    "permission_request",
+    "permission_batch",
+    "permission_auto",
+    "permission_timeout",
+    "error",
+    "cancelled",
+}
+
+# Conversations this server has run, so /initialize with resume survives a
+# server restart; set CLAUDE_SESSION_STORE to "" to keep nothing on disk
+SESSION_STORE_PATH = os.environ.get(
+    "CLAUDE_SESSION_STORE",
+    os.path.join(os.path.expanduser("~"), ".claude-rstudio", "sessions.json"),
+)
+session_store = SessionStore(SESSION_STORE_PATH) if SESSION_STORE_PATH else None
+
+
+class PendingPermission:
+    def __init__(
+        self,
+        tool_name: str,
+        input_data: Dict[str, Any],
+        timeout: Optional[float] = None,
+        timeout_approves: bool = False,
+    ):
+        self.tool_name = tool_name
+        self.input_data = input_data
+        loop = asyncio.get_running_loop()
+        self.future: asyncio.Future = loop.create_future()
+        self.expiry = (
+            loop.call_later(timeout, self.settle, timeout_approves, "timeout")
+            if timeout
+            else None
+        )
+
+    def settle(self, approved: bool, source: str) -> bool:
+        if self.future.done():
+            return False
+        self.future.set_result((approved, source))
+        return True
+
+    def discard(self):
+        if self.expiry is not None:
+            self.expiry.cancel()
+
 
 class SessionState:
-    def __init__(self):
+    def __init__(self, token: str):
+        self.token = token
         self.working_dir: Optional[str] = None
         self.auth_method: Optional[str] = None
         self.session_active: bool = False
         self.permission_mode: Optional[str] = None
-        self.pending_permissions: Dict[str, asyncio.Future] = {}
-        self.permission_queue: Optional[asyncio.Queue] = None
+        self.pending_permissions: Dict[str, PendingPermission] = {}
+        self.permission_policy = PermissionPolicy()
+        self.permission_timeout: float = PERMISSION_TIMEOUT
+        self.permission_timeout_action: str = PERMISSION_TIMEOUT_ACTION
+        # Per-query tally of how each permission was settled
+        self.permission_counts: Dict[str, int] = {}
+        self.event_queue: Optional[asyncio.Queue] = None
+        # Set per query; permission requests arriving within this window
+        # go out together as one permission_batch event
+        self.permission_batch_ms: Optional[int] = None
+        self.permission_batch: Optional[List[Dict[str, Any]]] = None
         self.allowed_tools: Optional[List[str]] = None
         self.disallowed_tools: Optional[List[str]] = None
         self.model: Optional[str] = None
@@ -50,18 +173,285 @@ class SessionState:
         self.max_turns: Optional[int] = None
         self.env: Optional[Dict[str, str]] = None
         self.add_dirs: Optional[List[str]] = None
+        self.stream_partial: bool = False
+        self.context_hashes: Dict[str, str] = {}
         self.session_id: Optional[str] = None
         self.sdk_client: Optional[ClaudeSDKClient] = None
+        self.trace: Optional[Trace] = None
+        self.queries: "OrderedDict[str, EventLog]" = OrderedDict()
+        # The query currently running, and why it is being interrupted if it is
+        self.active_query: Optional[str] = None
+        self.cancel_reason: Optional[str] = None
+        self.disconnect_policy: str = DISCONNECT_POLICY
+        # Queries still waiting for their turn: query_id -> (ticket, on_disconnect)
+        self.waiting: Dict[str, Tuple[Ticket, str]] = {}
+        # Token usage summed over the session's queries, for the prompt cache hit rate
+        self.usage_totals: Dict[str, int] = {}
+
+
+class SessionRegistry:
+    """Sessions keyed by the token that /initialize hands back to the client."""
+
+    def __init__(self):
+        self.sessions: Dict[str, SessionState] = {}
+
+    def create(self) -> SessionState:
+        token = secrets.token_urlsafe(16)
+        state = SessionState(token)
+        self.sessions[token] = state
+        return state
+
+    def get(self, token: Optional[str]) -> Optional[SessionState]:
+        # No token, no session: on a shared server a tokenless caller must
+        # not reach whichever session happens to be alone
+        if not token:
+            return None
+        return self.sessions.get(token)
+
+    def remove(self, token: str) -> Optional[SessionState]:
+        return self.sessions.pop(token, None)
+
+
+sessions = SessionRegistry()
+
+QUERY_DONE = object()
+
+# Running queries; held here so they outlive the stream that started them
+query_tasks = set()
+
+
+INITIALIZE_CONNECT_SECONDS = REGISTRY.histogram(
+    "claude_initialize_connect_seconds",
+    "Time /initialize spends obtaining a connected SDK client.",
+)
+QUERY_FIRST_EVENT_SECONDS = REGISTRY.histogram(
+    "claude_query_first_event_seconds",
+    "Time from the start of a query to its first streamed event.",
+)
+QUERY_DURATION_SECONDS = REGISTRY.histogram(
+    "claude_query_duration_seconds", "Total wall time of a query stream."
+)
+PERMISSION_WAIT_SECONDS = REGISTRY.histogram(
+    "claude_permission_wait_seconds",
+    "Time a tool permission request waits for /approve.",
+)
+EVENTS_TOTAL = REGISTRY.counter(
+    "claude_events_total", "Events emitted to clients, by type.", ["type"]
+)
+ERRORS_TOTAL = REGISTRY.counter(
+    "claude_errors_total", "Query errors, by error_type.", ["error_type"]
+)
+TOKENS_TOTAL = REGISTRY.counter(
+    "claude_tokens_total", "Tokens reported by ResultMessage usage, by kind.", ["kind"]
+)
+COST_USD_TOTAL = REGISTRY.counter(
+    "claude_cost_usd_total", "Sum of total_cost_usd reported by ResultMessage."
+)
+PERMISSION_DECISIONS_TOTAL = REGISTRY.counter(
+    "claude_permission_decisions_total",
+    "Tool permission decisions by source: user, rule, remembered, or the "
+    "timeout, limit, disconnect and shutdown fallbacks.",
+    ["source"],
+)
+QUERIES_CANCELLED_TOTAL = REGISTRY.counter(
+    "claude_queries_cancelled_total",
+    "Queries stopped before they finished, by reason (client, disconnect, dequeued).",
+    ["reason"],
+)
+TOKENS_SAVED_TOTAL = REGISTRY.counter(
+    "claude_cancel_tokens_saved_total",
+    "Estimated output tokens not generated because a query was interrupted: "
+    "the mean output of completed queries minus what the interrupted one produced.",
+)
+QUERY_QUEUE_SECONDS = REGISTRY.histogram(
+    "claude_query_queue_seconds",
+    "Time a query waits for its session's earlier queries and a server slot.",
+)
+QUERIES_REJECTED_TOTAL = REGISTRY.counter(
+    "claude_queries_rejected_total", "Queries turned away with 429 because the queue was full."
+)
+REGISTRY.gauge(
+    "claude_queued_queries",
+    "Queries waiting to start.",
+    function=lambda: scheduler.waiting,
+)
+RESPONSE_CACHE_TOTAL = REGISTRY.counter(
+    "claude_response_cache_total",
+    "Response cache lookups by outcome (hit, miss) and stored answers (store).",
+    ["outcome"],
+)
+REGISTRY.gauge(
+    "claude_response_cache_bytes",
+    "Bytes of event data held by the response cache.",
+    function=lambda: response_cache.size,
+)
+ACTIVE_STREAMS = REGISTRY.gauge("claude_active_streams", "Query streams in progress.")
+REGISTRY.gauge(
+    "claude_pending_permissions",
+    "Permission requests waiting for a decision.",
+    function=lambda: sum(len(s.pending_permissions) for s in sessions.sessions.values()),
+)
+REGISTRY.gauge(
+    "claude_sessions", "Sessions currently registered.", function=lambda: len(sessions.sessions)
+)
+REGISTRY.gauge(
+    "process_resident_memory_bytes",
+    "Resident memory of the server process.",
+    function=resident_memory_bytes,
+)
+
+USAGE_KINDS = (
+    "input_tokens",
+    "output_tokens",
+    "cache_creation_input_tokens",
+    "cache_read_input_tokens",
+)
+
+
+def prompt_cache_hit_rate(usage: Dict[str, float]) -> Optional[float]:
+    """Share of prompt tokens read from the API's prompt cache."""
+    read = usage.get("cache_read_input_tokens", 0)
+    total = read + usage.get("cache_creation_input_tokens", 0) + usage.get("input_tokens", 0)
+    return round(read / total, 4) if total else None
+
+
+REGISTRY.gauge(
+    "claude_prompt_cache_hit_ratio",
+    "cache_read_input_tokens over all prompt tokens, across every query so far.",
+    function=lambda: prompt_cache_hit_rate(
+        {kind: TOKENS_TOTAL.value(kind=kind) for kind in USAGE_KINDS}
+    )
+    or 0.0,
+)
+
+# Output tokens of queries that ran to completion, for the tokens-saved estimate
+completed_output = {"queries": 0, "tokens": 0}
+
+
+def usage_value(usage: Any, key: str) -> int:
+    # ResultMessage.usage is a plain dict in current SDKs
+    if isinstance(usage, dict):
+        return usage.get(key) or 0
+    return getattr(usage, key, 0) or 0
+
+
+async def emit(queue: asyncio.Queue, event: str, payload: Any):
+    EVENTS_TOTAL.inc(type=event)
+    if event == "error":
+        ERRORS_TOTAL.inc(error_type=payload.get("error_type", "unknown"))
+    await queue.put({"event": event, "data": await encode(payload)})
+
+
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CLAUDE_CONTEXT_TOKEN_BUDGET", 8000))
+
+context_store = ContextStore(
+    max_bytes=int(os.environ.get("CLAUDE_CONTEXT_STORE_MB", 64)) * 1024 * 1024
+)
+
+# Set CLAUDE_TRACE_FILE to write per-query spans as JSONL
+trace_exporter = exporter_from_env()
+
 
+def resolve_session(token: Optional[str]) -> SessionState:
+    state = sessions.get(token)
+    if state is None:
+        if token:
+            raise HTTPException(status_code=404, detail="Session not found")
+        raise HTTPException(
+            status_code=400,
+            detail="Missing X-Session-Token header. Call /initialize first.",
+        )
+    return state
+
+
+def settle_all_pending(state: SessionState, source: str):
+    """Deny every request still waiting on the UI so the SDK turn can move on."""
+    for pending in list(state.pending_permissions.values()):
+        pending.settle(False, source)
+
+
+async def close_session(state: SessionState):
+    for ticket, _ in list(state.waiting.values()):
+        scheduler.cancel(ticket)
+    settle_all_pending(state, "shutdown")
+    if state.sdk_client:
+        try:
+            await state.sdk_client.disconnect()
+            log.info("SDK client disconnected", extra={"session": state.token[:8]})
+        except Exception as e:
+            log.warning("Error disconnecting SDK client: %s", e)
+        state.sdk_client = None
+    state.session_active = False
+
+
+def stderr_callback(message: str):
+    # At INFO so CLAUDE_SDK_DEBUG output shows at the default log level
+    log.info("%s", message, extra={"source": "cli_stderr"})
 
-session_state = SessionState()
+
+async def dispatch_permission(
+    slot: PoolSlot, tool_name: str, input_data: Dict[str, Any], context
+) -> PermissionResultAllow | PermissionResultDeny:
+    # Pooled clients are connected before any session owns them
+    if slot.owner is None:
+        return PermissionResultDeny(message="No active session for this client")
+    return await can_use_tool_handler(slot.owner, tool_name, input_data, context)
+
+
+async def connect_client(slot: PoolSlot, fields: Dict[str, Any]):
+    if REPLAY_FIXTURES:
+        slot.client = ReplayClient(REPLAY_FIXTURES, REPLAY_SPEED)
+        return
+
+    options_dict = {
+        **fields,
+        "can_use_tool": partial(dispatch_permission, slot),
+        "stderr": stderr_callback,
+    }
+    if SDK_DEBUG:
+        options_dict["extra_args"] = {"debug-to-stderr": None}
+    if CLI_PATH:
+        options_dict["cli_path"] = CLI_PATH
+    slot.client = ClaudeSDKClient(ClaudeAgentOptions(**options_dict))
+    await slot.client.connect()
+
+
+def client_alive(slot: PoolSlot) -> bool:
+    """Whether an idle pooled client's CLI is still there to talk to."""
+    if not isinstance(slot.client, ClaudeSDKClient):
+        return slot.client is not None
+    transport = getattr(slot.client, "_transport", None)
+    if transport is None or not transport.is_ready():
+        return False
+    process = getattr(transport, "_process", None)
+    return process is None or process.returncode is None
+
+
+client_pool = ClientPool(
+    connect_client,
+    alive=client_alive,
+    min_size=int(os.environ.get("CLAUDE_POOL_MIN_SIZE", 1)),
+    max_size=int(os.environ.get("CLAUDE_POOL_MAX_SIZE", 4)),
+    idle_ttl=float(os.environ.get("CLAUDE_POOL_IDLE_TTL", 300)),
+)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    print("Claude RStudio SDK Server starting...", file=sys.stderr)
+    log_listener = setup_logging()
+    log.info("Claude RStudio SDK Server starting...")
+    client_pool.start()
+    if trace_exporter:
+        trace_exporter.start()
+        log.info("Writing traces", extra={"path": trace_exporter.path})
     yield
-    print("Claude RStudio SDK Server shutting down...", file=sys.stderr)
+    log.info("Claude RStudio SDK Server shutting down...")
+    for state in list(sessions.sessions.values()):
+        await close_session(state)
+    await client_pool.close()
+    if trace_exporter:
+        trace_exporter.stop()
+    log_listener.stop()
 
 
 app = FastAPI(title="Claude RStudio SDK Server", lifespan=lifespan)
@@ -81,20 +471,71 @@ class InitializeRequest(BaseModel):
     max_turns: Optional[int] = None
     env: Optional[Dict[str, str]] = None
     add_dirs: Optional[List[str]] = None
+    stream_partial: bool = False
+    # [{"tool": "Read", "action": "allow", "paths": ["**"]}, ...]; see permission_policy
+    permission_rules: Optional[List[Dict[str, Any]]] = None
+    # Seconds to wait for a decision (0 = forever) and what happens after
+    permission_timeout: Optional[float] = None
+    permission_timeout_action: Optional[str] = None
+    # Session id of an earlier conversation in working_dir to reconnect to;
+    # the client keeps it (from result events), the server never hands it out
+    resume: Optional[str] = None
 
 
 class QueryRequest(BaseModel):
     prompt: str
     context: Optional[Dict[str, Any]] = None
+    context_budget: Optional[int] = None
+    batch_window_ms: Optional[int] = None
+    batch_max_bytes: int = 65536
+    permission_batch_ms: Optional[int] = None
+    trace_events: bool = False
+    # "continue" or "interrupt"; defaults to CLAUDE_DISCONNECT_POLICY
+    on_disconnect: Optional[str] = None
+    # Use the response cache for this query; None follows CLAUDE_RESPONSE_CACHE
+    cache: Optional[bool] = None
 
 
 class ApproveRequest(BaseModel):
     request_id: str
     approved: bool
+    # "input" or "tool": apply this decision to later requests in the session
+    remember: Optional[str] = None
+
+
+class BulkApproveRequest(BaseModel):
+    decisions: List[ApproveRequest]
 
 
 @app.post("/initialize")
-async def initialize(req: InitializeRequest):
+async def initialize(
+    req: InitializeRequest, x_session_token: Optional[str] = Header(None)
+):
+    try:
+        permission_policy = PermissionPolicy.from_dicts(req.permission_rules, req.working_dir)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid permission_rules: {e}")
+    if req.permission_timeout_action not in (None, *TIMEOUT_ACTIONS):
+        raise HTTPException(
+            status_code=400,
+            detail=f"permission_timeout_action must be one of {', '.join(TIMEOUT_ACTIONS)}",
+        )
+
+    saved = (
+        session_store.get(req.resume, req.working_dir) if req.resume and session_store else None
+    )
+    if saved:
+        # Options given now win; the saved ones fill in what was left out
+        for name, value in saved["options"].items():
+            if getattr(req, name) is None:
+                setattr(req, name, value)
+
+    session_state = sessions.get(x_session_token)
+    if session_state is not None:
+        await close_session(session_state)
+    else:
+        session_state = sessions.create()
+
     try:
         session_state.working_dir = req.working_dir
         session_state.auth_method = req.auth_method
@@ -104,100 +545,255 @@ async def initialize(req: InitializeRequest):
         session_state.system_prompt = req.system_prompt
         session_state.max_turns = req.max_turns
         session_state.add_dirs = req.add_dirs
+        session_state.session_id = None
+        # A new conversation: its cache hit rate and diff bases start over
+        session_state.usage_totals = {}
+        session_state.context_hashes = {}
+        session_state.stream_partial = req.stream_partial
+        session_state.permission_policy = permission_policy
+        # Omitted means the server default, not whatever an earlier
+        # /initialize of this session asked for
+        session_state.permission_timeout = (
+            req.permission_timeout
+            if req.permission_timeout is not None
+            else PERMISSION_TIMEOUT
+        )
+        session_state.permission_timeout_action = (
+            req.permission_timeout_action or PERMISSION_TIMEOUT_ACTION
+        )
 
         env_vars = {}
         if req.auth_method == "api_key" and req.api_key:
             env_vars["ANTHROPIC_API_KEY"] = req.api_key
-            print(f"Using API key authentication", file=sys.stderr)
+            log.info("Using API key authentication")
         elif req.auth_method == "bedrock":
             env_vars["CLAUDE_CODE_USE_BEDROCK"] = "1"
             if req.aws_region:
                 env_vars["AWS_REGION"] = req.aws_region
             if req.aws_profile:
                 env_vars["AWS_PROFILE"] = req.aws_profile
-            print(f"Using AWS Bedrock authentication", file=sys.stderr)
+            log.info("Using AWS Bedrock authentication")
         elif req.auth_method == "subscription":
-            print(f"Using Claude subscription (stored credentials)", file=sys.stderr)
+            log.info("Using Claude subscription (stored credentials)")
 
         if req.env:
             env_vars.update(req.env)
 
+        # Kept per session and handed to the CLI subprocess; the server's own
+        # environment and cwd are shared by every session and stay untouched.
         session_state.env = env_vars
 
-        for key, value in env_vars.items():
-            os.environ[key] = value
-
-        session_state.model = req.model or os.environ.get(
-            "ANTHROPIC_MODEL", "claude-sonnet-4-5-20250929"
+        session_state.model = (
+            req.model
+            or env_vars.get("ANTHROPIC_MODEL")
+            or os.environ.get("ANTHROPIC_MODEL", "claude-sonnet-4-5-20250929")
         )
 
-        os.chdir(session_state.working_dir)
-
-        def stderr_callback(message: str):
-            print(f"[SDK STDERR] {message}", file=sys.stderr)
-
-        options_dict = {
+        # Everything that shapes the CLI subprocess; doubles as the pool key
+        fields = {
             "permission_mode": "acceptEdits",
-            "stderr": stderr_callback,
-            "extra_args": {"debug-to-stderr": None}
+            "cwd": session_state.working_dir,
+            "env": session_state.env,
         }
 
         if session_state.model:
-            options_dict["model"] = session_state.model
+            fields["model"] = session_state.model
 
         if session_state.allowed_tools:
-            options_dict["allowed_tools"] = session_state.allowed_tools
+            fields["allowed_tools"] = session_state.allowed_tools
 
         if session_state.disallowed_tools:
-            options_dict["disallowed_tools"] = session_state.disallowed_tools
+            fields["disallowed_tools"] = session_state.disallowed_tools
 
         if session_state.system_prompt:
-            options_dict["system_prompt"] = session_state.system_prompt
+            fields["system_prompt"] = session_state.system_prompt
 
         if session_state.max_turns:
-            options_dict["max_turns"] = session_state.max_turns
+            fields["max_turns"] = session_state.max_turns
 
         if session_state.add_dirs:
-            options_dict["add_dirs"] = session_state.add_dirs
+            fields["add_dirs"] = session_state.add_dirs
 
-        options = ClaudeAgentOptions(**options_dict)
-        session_state.sdk_client = ClaudeSDKClient(options)
-        await session_state.sdk_client.connect()
+        if session_state.stream_partial:
+            fields["include_partial_messages"] = True
 
-        print(f"SDK client created and connected", file=sys.stderr)
+        connect_started = time.perf_counter()
+        resumed = None
+        if saved:
+            # A resumed conversation is unique to this session, so it gets
+            # its own client instead of a pooled (and pre-warmed) one
+            slot = PoolSlot(options_key(fields))
+            try:
+                await connect_client(slot, {**fields, "resume": req.resume})
+                resumed = session_state.session_id = req.resume
+            except Exception as e:
+                log.warning("Could not resume session %s, starting fresh: %s", req.resume, e)
+                with suppress(Exception):
+                    if slot.client:
+                        await slot.client.disconnect()
+                with suppress(OSError):
+                    session_store.remove(req.resume)
+        if resumed is None:
+            slot = await client_pool.acquire(fields)
+        INITIALIZE_CONNECT_SECONDS.observe(time.perf_counter() - connect_started)
+        slot.owner = session_state
+        session_state.sdk_client = slot.client
+
+        log.info(
+            "SDK client created and connected", extra={"session": session_state.token[:8]}
+        )
 
         session_state.session_active = True
 
         return {
             "status": "ok",
+            "session_token": session_state.token,
             "working_dir": session_state.working_dir,
             "auth_method": session_state.auth_method,
             "permission_mode": req.permission_mode,
             "model": session_state.model,
+            "stream_partial": session_state.stream_partial,
+            "resumed_session_id": resumed,
         }
 
     except Exception as e:
+        sessions.remove(session_state.token)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-async def can_use_tool_handler(
-    tool_name: str, input_data: Dict[str, Any], context
-) -> PermissionResultAllow | PermissionResultDeny:
-    request_id = f"perm_{int(asyncio.get_event_loop().time() * 1000)}_{tool_name}"
-    future = asyncio.Future()
-    session_state.pending_permissions[request_id] = future
+def remember_session(session_state: SessionState, session_id: str):
+    if session_store is None or not session_state.working_dir:
+        return
+    options = {name: getattr(session_state, name) for name in RESUMABLE_OPTIONS}
+    try:
+        session_store.put(session_id, session_state.working_dir, options)
+    except OSError as e:
+        log.warning("Could not save session %s: %s", session_id, e)
+
+
+def count_permission(session_state: SessionState, source: str):
+    PERMISSION_DECISIONS_TOTAL.inc(source=source)
+    counts = session_state.permission_counts
+    counts[source] = counts.get(source, 0) + 1
+
+
+async def announce_permission(session_state: SessionState, request: Dict[str, Any]):
+    """Send a permission request to the client, grouping parallel tool calls.
+
+    Without permission_batch_ms each request is its own permission_request
+    event. With it, the first request opens a batch, requests arriving in
+    the window join it, and the first one sends them all as a single
+    permission_batch event (a lone request still goes out as
+    permission_request).
+    """
+    queue = session_state.event_queue
+    if not session_state.permission_batch_ms:
+        await emit(queue, "permission_request", request)
+        return
+    if session_state.permission_batch is not None:
+        session_state.permission_batch.append(request)
+        return
+
+    batch = session_state.permission_batch = [request]
+    try:
+        await asyncio.sleep(session_state.permission_batch_ms / 1000)
+    except asyncio.CancelledError:
+        # The SDK withdrew the request that opened the batch; the ones that
+        # joined it are still waiting and must reach the client regardless
+        if len(batch) > 1:
+            task = asyncio.create_task(send_permission_batch(queue, batch[1:]))
+            query_tasks.add(task)
+            task.add_done_callback(query_tasks.discard)
+        raise
+    finally:
+        if session_state.permission_batch is batch:
+            session_state.permission_batch = None
+    await send_permission_batch(queue, batch)
+
+
+async def send_permission_batch(queue: asyncio.Queue, batch: List[Dict[str, Any]]):
+    if len(batch) == 1:
+        await emit(queue, "permission_request", batch[0])
+    else:
+        await emit(queue, "permission_batch", {"requests": batch})
 
-    print(f"Permission request: {request_id} for tool {tool_name}", file=sys.stderr)
 
-    if session_state.permission_queue:
-        await session_state.permission_queue.put(
-            {"request_id": request_id, "tool_name": tool_name, "input": input_data}
+async def can_use_tool_handler(
+    session_state: SessionState, tool_name: str, input_data: Dict[str, Any], context
+) -> PermissionResultAllow | PermissionResultDeny:
+    decision = session_state.permission_policy.decide(tool_name, input_data)
+    if decision is None and session_state.event_queue is None:
+        # The turn outlived its stream; nobody is left to answer
+        decision = (False, "disconnect")
+    elif decision is None and session_state.cancel_reason:
+        decision = (False, "cancelled")
+    elif decision is None and len(session_state.pending_permissions) >= MAX_PENDING_PERMISSIONS:
+        log.warning(
+            "Too many pending permission requests",
+            extra={"session": session_state.token[:8], "tool": tool_name},
         )
+        decision = (False, "limit")
+    if decision is not None:
+        approved, source = decision
+        count_permission(session_state, source)
+        log.debug(
+            "Permission settled without UI",
+            extra={"tool": tool_name, "approved": approved, "source": source},
+        )
+        if session_state.event_queue:
+            await emit(
+                session_state.event_queue,
+                "permission_auto",
+                {"tool_name": tool_name, "approved": approved, "source": source},
+            )
+        if approved:
+            return PermissionResultAllow()
+        return PermissionResultDeny(message=f"Denied by {source} permission decision")
+
+    request_id = f"perm_{secrets.token_urlsafe(9)}"
+    pending = PendingPermission(
+        tool_name,
+        input_data,
+        session_state.permission_timeout,
+        session_state.permission_timeout_action == "allow",
+    )
+    session_state.pending_permissions[request_id] = pending
+    event_queue = session_state.event_queue
 
-    result = await future
+    log.info("Permission request", extra={"request_id": request_id, "tool": tool_name})
 
-    del session_state.pending_permissions[request_id]
-    print(f"Permission resolved: {request_id} -> {result}", file=sys.stderr)
+    span = (
+        session_state.trace.span(
+            "permission_wait", tool_name=tool_name, request_id=request_id
+        )
+        if session_state.trace
+        else None
+    )
+    wait_started = time.perf_counter()
+    try:
+        await announce_permission(
+            session_state,
+            {"request_id": request_id, "tool_name": tool_name, "input": input_data},
+        )
+        result, source = await pending.future
+    finally:
+        # Also runs when the SDK cancels the callback, so nothing is left behind
+        pending.discard()
+        session_state.pending_permissions.pop(request_id, None)
+    PERMISSION_WAIT_SECONDS.observe(time.perf_counter() - wait_started)
+    count_permission(session_state, source)
+    if span:
+        span.end(approved=bool(result), source=source)
+
+    log.info(
+        "Permission resolved",
+        extra={"request_id": request_id, "approved": result, "source": source},
+    )
+    if source == "timeout" and event_queue is session_state.event_queue:
+        # Lets the UI close a prompt that can no longer be answered
+        await emit(
+            event_queue, "permission_timeout", {"request_id": request_id, "approved": result}
+        )
 
     if result:
         return PermissionResultAllow()
@@ -205,331 +801,711 @@ async def can_use_tool_handler(
         return PermissionResultDeny()
 
 
+def settle_remembered(session_state: SessionState):
+    """Resolve requests still waiting on the UI that a new remembered decision covers."""
+    for pending in session_state.pending_permissions.values():
+        if pending.future.done():
+            continue
+        decision = session_state.permission_policy.decide(pending.tool_name, pending.input_data)
+        if decision is not None:
+            pending.settle(*decision)
+
+
+def check_remember(decisions: List[ApproveRequest]):
+    for req in decisions:
+        if req.remember is not None and req.remember not in REMEMBER_SCOPES:
+            raise HTTPException(
+                status_code=400, detail=f"remember must be one of {', '.join(REMEMBER_SCOPES)}"
+            )
+
+
+def settle_permission(session_state: SessionState, req: ApproveRequest) -> bool:
+    """Apply one user decision; False if the request is unknown or already settled."""
+    pending = session_state.pending_permissions.get(req.request_id)
+    if pending is None or not pending.settle(req.approved, "user"):
+        return False
+
+    if req.remember:
+        session_state.permission_policy.remember(
+            pending.tool_name, pending.input_data, req.approved, req.remember
+        )
+        settle_remembered(session_state)
+    return True
+
+
 @app.post("/approve")
-async def approve_permission(req: ApproveRequest):
-    if req.request_id not in session_state.pending_permissions:
+async def approve_permission(
+    req: ApproveRequest, x_session_token: Optional[str] = Header(None)
+):
+    session_state = resolve_session(x_session_token)
+    check_remember([req])
+    if not settle_permission(session_state, req):
         raise HTTPException(status_code=404, detail="Permission request not found")
 
-    future = session_state.pending_permissions[req.request_id]
-    future.set_result(req.approved)
-
     return {"status": "ok"}
 
 
-@app.post("/query")
-async def query_agent(req: QueryRequest):
-    if not session_state.session_active:
+@app.post("/approve/bulk")
+async def approve_permissions(
+    req: BulkApproveRequest, x_session_token: Optional[str] = Header(None)
+):
+    """Settle many permission requests in one call, each with its own decision.
+
+    Unknown or already settled ids don't fail the call; their item reports
+    "not_found" and the remaining decisions still apply.
+    """
+    session_state = resolve_session(x_session_token)
+    check_remember(req.decisions)
+    results = [
+        {
+            "request_id": item.request_id,
+            "status": "ok" if settle_permission(session_state, item) else "not_found",
+        }
+        for item in req.decisions
+    ]
+    return {"results": results}
+
+
+def keep_query(session_state: SessionState, events: EventLog):
+    session_state.queries[events.query_id] = events
+    while len(session_state.queries) > RESUME_QUERIES:
+        session_state.queries.popitem(last=False)
+
+
+async def interrupt_query(session_state: SessionState, reason: str) -> bool:
+    """Interrupt the running query; run_query drains the turn and emits cancelled."""
+    if session_state.active_query is None or session_state.cancel_reason:
+        return False
+    session_state.cancel_reason = reason
+    QUERIES_CANCELLED_TOTAL.inc(reason=reason)
+    log.info(
+        "Interrupting query",
+        extra={"query_id": session_state.active_query, "reason": reason},
+    )
+    # A turn blocked on a permission prompt would never see the interrupt
+    settle_all_pending(session_state, "cancelled")
+    try:
+        await session_state.sdk_client.interrupt()
+    except Exception as e:
+        log.warning("Interrupt failed: %s", e)
+    return True
+
+
+def abandon_query(session_state: SessionState, events: EventLog):
+    if events.closed or events.followers:
+        return
+    waiting = session_state.waiting.get(events.query_id)
+    if waiting is not None:
+        ticket, policy = waiting
+        if policy == "interrupt":
+            # Never started, so nothing to interrupt; just leave the line
+            scheduler.cancel(ticket)
+        return
+    if session_state.disconnect_policy == "interrupt":
+        if session_state.active_query == events.query_id:
+            task = asyncio.create_task(interrupt_query(session_state, "disconnect"))
+            query_tasks.add(task)
+            task.add_done_callback(query_tasks.discard)
+        return
+    log.info(
+        "Query stream not resumed; denying its pending permissions",
+        extra={"query_id": events.query_id},
+    )
+    settle_all_pending(session_state, "disconnect")
+
+
+async def follow_query(
+    session_state: SessionState, events: EventLog, after: int = 0
+) -> AsyncIterator[Tuple[int, str, bytes, float]]:
+    """Stream a query's events from seq after; the query itself runs on regardless."""
+    events.followers += 1
+    try:
+        async for entry in events.follow(after):
+            yield entry
+    except EventsExpired as e:
+        yield 0, "error", dumps(
+            {
+                "error": str(e),
+                "error_type": "events_expired",
+                "message": "This stream fell too far behind to resume",
+            }
+        ), time.time()
+    finally:
+        events.followers -= 1
+        if not events.closed and not events.followers:
+            # Give the client a chance to reconnect before giving up on it
+            asyncio.get_running_loop().call_later(
+                RESUME_GRACE, abandon_query, session_state, events
+            )
+
+
+def start_query(session_state: SessionState, req: QueryRequest) -> EventLog:
+    """Start one query in the background; its events go to the returned log."""
+    if req.on_disconnect not in (None, *DISCONNECT_POLICIES):
         raise HTTPException(
-            status_code=400, detail="Session not initialized. Call /initialize first."
+            status_code=400,
+            detail=f"on_disconnect must be one of {', '.join(DISCONNECT_POLICIES)}",
+        )
+    trace = Trace(
+        "query", session=session_state.token[:8], prompt_chars=len(req.prompt)
+    )
+
+    context = req.context
+    missing = None
+    if context:
+        try:
+            with trace.span("context_resolve"):
+                context = resolve_context(
+                    context_store, context, session_state.context_hashes
+                )
+        except ContextMissing as e:
+            missing = e
+
+    key = None
+    cached = None
+    if missing is None and (req.cache if req.cache is not None else RESPONSE_CACHE_DEFAULT):
+        key = cache_key(
+            session_state.model,
+            session_state.system_prompt,
+            session_state.working_dir,
+            req.prompt,
+            context,
         )
+        cached = response_cache.get(key)
+        RESPONSE_CACHE_TOTAL.inc(outcome="miss" if cached is None else "hit")
 
-    async def event_generator():
-        session_state.permission_queue = asyncio.Queue()
-        event_queue = asyncio.Queue()
-        query_done = asyncio.Event()
-
-        async def permission_monitor():
-            while not query_done.is_set():
-                try:
-                    perm_req = await asyncio.wait_for(
-                        session_state.permission_queue.get(), timeout=0.1
-                    )
-                    await event_queue.put(
-                        {"event": "permission_request", "data": json.dumps(perm_req)}
-                    )
-                except asyncio.TimeoutError:
-                    continue
-
-        async def run_query():
-            try:
-                full_prompt = req.prompt
-
-                if req.context:
-                    context_parts = []
-                    if req.context.get("path"):
-                        context_parts.append(f"Current file: {req.context['path']}")
-                    if req.context.get("selection") and req.context["selection"].get(
-                        "text"
-                    ):
-                        context_parts.append(
-                            f"Selected code:\n```\n{req.context['selection']['text']}\n```"
-                        )
-                    elif req.context.get("content"):
-                        context_parts.append(
-                            f"File content:\n```\n{req.context['content']}\n```"
-                        )
+    # Only queries that will actually run need a turn
+    ticket = None
+    if missing is None and cached is None:
+        try:
+            ticket = scheduler.submit(session_state.token)
+        except QueueFull as e:
+            QUERIES_REJECTED_TOTAL.inc()
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+        running = session_state.queries.get(session_state.active_query)
+        if running is not None and not running.followers:
+            # Nobody can see that turn's prompts and this query waits on it;
+            # don't make it sit out the rest of the resume grace period
+            abandon_query(session_state, running)
+
+    events = EventLog(secrets.token_urlsafe(9), EVENT_LOG_BYTES)
+    keep_query(session_state, events)
+
+    def record(event: str, data: bytes):
+        if req.trace_events:
+            data = annotate(data, trace.trace_id, time.time())
+        events.append(event, data)
+
+    # The id to resume with if the stream drops
+    EVENTS_TOTAL.inc(type="query")
+    record("query", dumps({"query_id": events.query_id}))
+
+    if missing is not None:
+        # The client resends the full content on this signal
+        EVENTS_TOTAL.inc(type="context_missing")
+        trace.finish(trace_exporter)
+        record(
+            "context_missing",
+            dumps({"content_hash": missing.content_hash, "path": missing.path}),
+        )
+        events.close()
+        return events
+    if context and context.get("content_hash"):
+        EVENTS_TOTAL.inc(type="context")
+        record(
+            "context",
+            dumps({"path": context.get("path"), "content_hash": context["content_hash"]}),
+        )
 
-                    if context_parts:
-                        full_prompt = "\n\n".join(context_parts) + "\n\n" + req.prompt
+    if cached is not None:
+        # Cached as sent before batching; batch them as this request asked
+        if req.batch_window_ms:
+            cached = coalesce_frames(cached, req.batch_max_bytes)
+        for event, data in cached:
+            EVENTS_TOTAL.inc(type=event)
+            record(event, mark_cached(data) if event == "result" else data)
+        trace.root.set(cached=True)
+        trace.finish(trace_exporter)
+        events.close()
+        return events
+
+    # What run_query saw, to decide whether the answer may be cached
+    turn = {"tools": [], "ok": False}
+
+    # Query output and permission requests share one queue; run_query
+    # closes it with QUERY_DONE so the consumer never has to poll.
+    event_queue = asyncio.Queue()
+    session_state.waiting[events.query_id] = (ticket, req.on_disconnect or DISCONNECT_POLICY)
+
+    async def run_query():
+        # Tool spans stay open from the ToolUseBlock until its ToolResultBlock
+        tool_spans = {}
+        try:
+            assembly_span = trace.span("context_assembly")
+            full_prompt, prompt_stats = build_prompt(
+                req.prompt, context, req.context_budget or CONTEXT_TOKEN_BUDGET
+            )
+            prompt_stats["prompt_tokens_estimate"] = estimate_tokens(full_prompt)
+            assembly_span.end(**prompt_stats)
 
-                print(f"Querying with prompt: {full_prompt[:100]}...", file=sys.stderr)
+            log.debug("Querying with prompt: %s...", full_prompt[:100])
 
-                if not session_state.sdk_client:
-                    raise Exception("SDK client not initialized. Call /initialize first.")
+            if not session_state.sdk_client:
+                raise Exception("SDK client not initialized. Call /initialize first.")
 
+            with trace.span("sdk.query", prompt_chars=len(full_prompt)):
                 await session_state.sdk_client.query(full_prompt)
 
-                async for message in session_state.sdk_client.receive_response():
-                        msg_type = type(message).__name__
-                        print(f"Got message: {msg_type}", file=sys.stderr)
-
-                        if msg_type == "ResultMessage":
-                            session_id = getattr(message, "session_id", None)
-                            if session_id:
-                                session_state.session_id = session_id
-                                print(
-                                    f"Captured session_id: {session_id}",
-                                    file=sys.stderr,
+            # Set once text deltas have gone out for the current assistant message
+            text_streamed = False
+            first_message_span = trace.span("first_message")
+            output_tokens = 0
+            recorder = Recorder(full_prompt) if RECORD_DIR else None
+
+            async for message in session_state.sdk_client.receive_response():
+                    msg_type = type(message).__name__
+                    first_message_span.end(message_type=msg_type)
+                    if recorder:
+                        recorder.add(message)
+
+                    if msg_type == "StreamEvent":
+                        stream_event = getattr(message, "event", None) or {}
+                        delta = stream_event.get("delta") or {}
+                        if (
+                            stream_event.get("type") == "content_block_delta"
+                            and delta.get("type") == "text_delta"
+                        ):
+                            text_streamed = True
+                            await emit(
+                                event_queue,
+                                "text_delta",
+                                {"text": delta.get("text", "")},
+                            )
+                        continue
+
+                    log.debug("Got message: %s", msg_type)
+
+                    if msg_type == "ResultMessage":
+                        result_span = trace.span("result")
+                        session_id = getattr(message, "session_id", None)
+                        if session_id:
+                            if session_id != session_state.session_id:
+                                remember_session(session_state, session_id)
+                            session_state.session_id = session_id
+                            log.debug("Captured session_id: %s", session_id)
+
+                        result_data = {
+                            "duration_ms": getattr(message, "duration_ms", None),
+                            "duration_api_ms": getattr(
+                                message, "duration_api_ms", None
+                            ),
+                            "is_error": getattr(message, "is_error", False),
+                            "num_turns": getattr(message, "num_turns", None),
+                            "session_id": session_id,
+                            "total_cost_usd": getattr(
+                                message, "total_cost_usd", None
+                            ),
+                            "prompt_stats": prompt_stats,
+                            # How many permission checks needed the UI ("user")
+                            # and how many rules/remembered decisions settled
+                            "permissions": dict(session_state.permission_counts),
+                        }
+                        usage = getattr(message, "usage", None)
+                        if usage is not None:
+                            result_data["usage"] = {
+                                kind: usage_value(usage, kind) for kind in USAGE_KINDS
+                            }
+                            for kind, count in result_data["usage"].items():
+                                TOKENS_TOTAL.inc(count, kind=kind)
+                            output_tokens = result_data["usage"]["output_tokens"]
+                            totals = session_state.usage_totals
+                            for kind, count in result_data["usage"].items():
+                                totals[kind] = totals.get(kind, 0) + count
+                            result_data["prompt_cache"] = {
+                                "hit_rate": prompt_cache_hit_rate(result_data["usage"]),
+                                "session_hit_rate": prompt_cache_hit_rate(totals),
+                            }
+                        if result_data["total_cost_usd"]:
+                            COST_USD_TOTAL.inc(result_data["total_cost_usd"])
+                        turn["ok"] = not result_data["is_error"]
+                        await emit(event_queue, "result", result_data)
+                        result_span.end(
+                            duration_ms=result_data["duration_ms"],
+                            duration_api_ms=result_data["duration_api_ms"],
+                            num_turns=result_data["num_turns"],
+                            total_cost_usd=result_data["total_cost_usd"],
+                            is_error=result_data["is_error"],
+                            **result_data.get("usage", {}),
+                        )
+                        trace.root.set(duration_api_ms=result_data["duration_api_ms"])
+                        log.info(
+                            "Query finished",
+                            extra={
+                                "cost_usd": result_data["total_cost_usd"],
+                                "duration_ms": result_data["duration_ms"],
+                            },
+                        )
+
+                    if hasattr(message, "content"):
+                        for block in message.content:
+                            block_type = type(block).__name__
+
+                            if block_type == "ThinkingBlock":
+                                thinking_data = {
+                                    "thinking": getattr(block, "thinking", ""),
+                                    "signature": getattr(block, "signature", None),
+                                }
+                                await emit(event_queue, "thinking", thinking_data)
+                                log.debug(
+                                    "Emitted ThinkingBlock: %d chars",
+                                    len(thinking_data["thinking"]),
                                 )
 
-                            result_data = {
-                                "duration_ms": getattr(message, "duration_ms", None),
-                                "duration_api_ms": getattr(
-                                    message, "duration_api_ms", None
-                                ),
-                                "is_error": getattr(message, "is_error", False),
-                                "num_turns": getattr(message, "num_turns", None),
-                                "session_id": session_id,
-                                "total_cost_usd": getattr(
-                                    message, "total_cost_usd", None
-                                ),
-                            }
-                            if hasattr(message, "usage"):
-                                result_data["usage"] = {
-                                    "input_tokens": getattr(
-                                        message.usage, "input_tokens", 0
-                                    ),
-                                    "output_tokens": getattr(
-                                        message.usage, "output_tokens", 0
-                                    ),
-                                    "cache_creation_input_tokens": getattr(
-                                        message.usage, "cache_creation_input_tokens", 0
-                                    ),
-                                    "cache_read_input_tokens": getattr(
-                                        message.usage, "cache_read_input_tokens", 0
-                                    ),
+                            elif block_type == "ToolUseBlock":
+                                tool_use_data = {
+                                    "id": getattr(block, "id", None),
+                                    "name": getattr(block, "name", ""),
+                                    "input": getattr(block, "input", {}),
                                 }
-                            await event_queue.put(
-                                {"event": "result", "data": json.dumps(result_data)}
-                            )
-                            print(
-                                f"Emitted ResultMessage: cost=${result_data.get('total_cost_usd', 0):.4f}",
-                                file=sys.stderr,
-                            )
+                                turn["tools"].append(tool_use_data["name"])
+                                tool_spans[tool_use_data["id"]] = trace.span(
+                                    "tool_use",
+                                    tool_name=tool_use_data["name"],
+                                    tool_use_id=tool_use_data["id"],
+                                )
+                                await emit(event_queue, "tool_use", tool_use_data)
+                                log.debug(
+                                    "Emitted ToolUseBlock: %s", tool_use_data["name"]
+                                )
 
-                        if hasattr(message, "content"):
-                            for block in message.content:
-                                block_type = type(block).__name__
-
-                                if block_type == "ThinkingBlock":
-                                    thinking_data = {
-                                        "thinking": getattr(block, "thinking", ""),
-                                        "signature": getattr(block, "signature", None),
-                                    }
-                                    await event_queue.put(
-                                        {
-                                            "event": "thinking",
-                                            "data": json.dumps(thinking_data),
-                                        }
-                                    )
-                                    print(
-                                        f"Emitted ThinkingBlock: {len(thinking_data['thinking'])} chars",
-                                        file=sys.stderr,
-                                    )
+                            elif hasattr(block, "text"):
+                                text_data = {"text": block.text}
+                                if text_streamed:
+                                    text_data["streamed"] = True
+                                await emit(event_queue, "text", text_data)
+                                log.debug(
+                                    "Emitted TextBlock: %d chars", len(block.text)
+                                )
 
-                                elif block_type == "ToolUseBlock":
-                                    tool_use_data = {
-                                        "id": getattr(block, "id", None),
-                                        "name": getattr(block, "name", ""),
-                                        "input": getattr(block, "input", {}),
-                                    }
-                                    await event_queue.put(
-                                        {
-                                            "event": "tool_use",
-                                            "data": json.dumps(tool_use_data),
-                                        }
+                            elif block_type == "ToolResultBlock" and hasattr(
+                                block, "content"
+                            ):
+                                tool_span = tool_spans.pop(
+                                    getattr(block, "tool_use_id", None), None
+                                )
+                                if tool_span:
+                                    tool_span.end(
+                                        is_error=bool(getattr(block, "is_error", False))
                                     )
-                                    print(
-                                        f"Emitted ToolUseBlock: {tool_use_data['name']}",
-                                        file=sys.stderr,
+                                if isinstance(block.content, str):
+                                    await emit(
+                                        event_queue,
+                                        "tool_result",
+                                        {"content": block.content},
                                     )
-
-                                elif hasattr(block, "text"):
-                                    await event_queue.put(
-                                        {
-                                            "event": "text",
-                                            "data": json.dumps({"text": block.text}),
-                                        }
-                                    )
-                                    print(
-                                        f"Emitted TextBlock: {len(block.text)} chars",
-                                        file=sys.stderr,
+                                    log.debug(
+                                        "Emitted ToolResult: %d chars", len(block.content)
                                     )
 
-                                elif block_type == "ToolResultBlock" and hasattr(
-                                    block, "content"
-                                ):
-                                    if isinstance(block.content, str):
-                                        await event_queue.put(
-                                            {
-                                                "event": "tool_result",
-                                                "data": json.dumps(
-                                                    {"content": block.content}
-                                                ),
-                                            }
-                                        )
-                                        print(
-                                            f"Emitted ToolResult: {len(block.content)} chars",
-                                            file=sys.stderr,
-                                        )
-
-                await event_queue.put(
-                    {"event": "complete", "data": json.dumps({"status": "complete"})}
+                        text_streamed = False
+
+            if recorder:
+                await recorder.save(RECORD_DIR, session_state.token[:8])
+
+            if session_state.cancel_reason:
+                saved = 0
+                if completed_output["queries"]:
+                    mean = completed_output["tokens"] / completed_output["queries"]
+                    saved = max(0, round(mean) - output_tokens)
+                TOKENS_SAVED_TOTAL.inc(saved)
+                await emit(
+                    event_queue,
+                    "cancelled",
+                    {"reason": session_state.cancel_reason, "tokens_saved_estimate": saved},
                 )
+            else:
+                completed_output["queries"] += 1
+                completed_output["tokens"] += output_tokens
+
+            await emit(event_queue, "complete", {"status": "complete"})
+
+        except CLINotFoundError as e:
+            log.error("CLI not found error: %s", e)
+            await emit(
+                event_queue,
+                "error",
+                {
+                    "error": str(e),
+                    "error_type": "cli_not_found",
+                    "message": "Claude CLI not found. Install: npm install -g @anthropic-ai/claude-code",
+                },
+            )
+        except CLIConnectionError as e:
+            log.error("CLI connection error: %s", e)
+            await emit(
+                event_queue,
+                "error",
+                {
+                    "error": str(e),
+                    "error_type": "connection_error",
+                    "message": f"Connection to Claude failed: {str(e)}",
+                },
+            )
+        except ProcessError as e:
+            log.error("Process error: %s", e)
+            exit_code = getattr(e, "exit_code", None)
+            await emit(
+                event_queue,
+                "error",
+                {
+                    "error": str(e),
+                    "error_type": "process_error",
+                    "exit_code": exit_code,
+                    "message": f"Claude process error (exit code {exit_code}): {str(e)}",
+                },
+            )
+        except CLIJSONDecodeError as e:
+            log.error("JSON decode error: %s", e)
+            await emit(
+                event_queue,
+                "error",
+                {
+                    "error": str(e),
+                    "error_type": "json_decode_error",
+                    "message": f"Failed to parse Claude response: {str(e)}",
+                },
+            )
+        except ClaudeSDKError as e:
+            log.error("SDK error: %s", e)
+            await emit(
+                event_queue,
+                "error",
+                {
+                    "error": str(e),
+                    "error_type": "sdk_error",
+                    "message": str(e),
+                },
+            )
+        except Exception as e:
+            log.exception("Query error: %s", e)
+            await emit(
+                event_queue,
+                "error",
+                {
+                    "error": str(e),
+                    "error_type": "unknown",
+                    "message": str(e),
+                },
+            )
+        finally:
+            await event_queue.put(QUERY_DONE)
+
+    async def report_position(ahead: int, scope: str):
+        EVENTS_TOTAL.inc(type="queued")
+        record("queued", dumps({"position": ahead, "waiting_for": scope}))
+
+    async def pump():
+        queued = time.perf_counter()
+        try:
+            with trace.span("queue_wait"):
+                started = await scheduler.wait(ticket, report_position)
+        finally:
+            session_state.waiting.pop(events.query_id, None)
+        QUERY_QUEUE_SECONDS.observe(time.perf_counter() - queued)
+        if not started:
+            QUERIES_CANCELLED_TOTAL.inc(reason="dequeued")
+            EVENTS_TOTAL.inc(type="cancelled")
+            EVENTS_TOTAL.inc(type="complete")
+            record("cancelled", dumps({"reason": "dequeued", "tokens_saved_estimate": 0}))
+            record("complete", dumps({"status": "complete"}))
+            trace.finish(trace_exporter)
+            events.close()
+            return
+
+        session_state.event_queue = event_queue
+        session_state.trace = trace
+        session_state.permission_counts = {}
+        session_state.permission_batch_ms = req.permission_batch_ms
+        session_state.active_query = events.query_id
+        session_state.cancel_reason = None
+        session_state.disconnect_policy = req.on_disconnect or DISCONNECT_POLICY
+
+        query_started = time.perf_counter()
+        first_event = True
+        ACTIVE_STREAMS.inc()
+        query_task = asyncio.create_task(run_query())
+        frames = [] if key else None
 
-            except CLINotFoundError as e:
-                print(f"CLI not found error: {str(e)}", file=sys.stderr)
-                await event_queue.put(
-                    {
-                        "event": "error",
-                        "data": json.dumps(
-                            {
-                                "error": str(e),
-                                "error_type": "cli_not_found",
-                                "message": "Claude CLI not found. Install: npm install -g @anthropic-ai/claude-code",
-                            }
-                        ),
-                    }
-                )
-            except CLIConnectionError as e:
-                print(f"CLI connection error: {str(e)}", file=sys.stderr)
-                await event_queue.put(
-                    {
-                        "event": "error",
-                        "data": json.dumps(
-                            {
-                                "error": str(e),
-                                "error_type": "connection_error",
-                                "message": f"Connection to Claude failed: {str(e)}",
-                            }
-                        ),
-                    }
-                )
-            except ProcessError as e:
-                print(f"Process error: {str(e)}", file=sys.stderr)
-                exit_code = getattr(e, "exit_code", None)
-                await event_queue.put(
-                    {
-                        "event": "error",
-                        "data": json.dumps(
-                            {
-                                "error": str(e),
-                                "error_type": "process_error",
-                                "exit_code": exit_code,
-                                "message": f"Claude process error (exit code {exit_code}): {str(e)}",
-                            }
-                        ),
-                    }
-                )
-            except CLIJSONDecodeError as e:
-                print(f"JSON decode error: {str(e)}", file=sys.stderr)
-                await event_queue.put(
-                    {
-                        "event": "error",
-                        "data": json.dumps(
-                            {
-                                "error": str(e),
-                                "error_type": "json_decode_error",
-                                "message": f"Failed to parse Claude response: {str(e)}",
-                            }
-                        ),
-                    }
-                )
-            except ClaudeSDKError as e:
-                print(f"SDK error: {str(e)}", file=sys.stderr)
-                await event_queue.put(
-                    {
-                        "event": "error",
-                        "data": json.dumps(
-                            {
-                                "error": str(e),
-                                "error_type": "sdk_error",
-                                "message": str(e),
-                            }
-                        ),
-                    }
-                )
-            except Exception as e:
-                print(f"Query error: {str(e)}", file=sys.stderr)
-                import traceback
-
-                traceback.print_exc(file=sys.stderr)
-                await event_queue.put(
-                    {
-                        "event": "error",
-                        "data": json.dumps(
-                            {
-                                "error": str(e),
-                                "error_type": "unknown",
-                                "message": str(e),
-                            }
-                        ),
-                    }
-                )
-            finally:
-                query_done.set()
+        def capture(event: Dict[str, Any]):
+            nonlocal frames
+            if frames is None:
+                return
+            if event["event"] in UNCACHEABLE_EVENTS:
+                frames = None
+            else:
+                frames.append((event["event"], event["data"]))
 
-        monitor_task = asyncio.create_task(permission_monitor())
-        query_task = asyncio.create_task(run_query())
+        try:
+            async for event in coalesce_events(
+                event_queue,
+                QUERY_DONE,
+                req.batch_window_ms,
+                req.batch_max_bytes,
+                tap=capture if key else None,
+            ):
+                if first_event:
+                    QUERY_FIRST_EVENT_SECONDS.observe(time.perf_counter() - query_started)
+                    first_event = False
+                if event["event"] == "error":
+                    trace.root.error = "error event sent to client"
+                record(event["event"], event["data"])
+
+            await query_task
+            if (
+                frames is not None
+                and turn["ok"]
+                and cacheable_turn(turn["tools"])
+                and response_cache.put(key, frames)
+            ):
+                RESPONSE_CACHE_TOTAL.inc(outcome="store")
+        finally:
+            ACTIVE_STREAMS.dec()
+            QUERY_DURATION_SECONDS.observe(time.perf_counter() - query_started)
+            session_state.event_queue = None
+            session_state.permission_batch_ms = None
+            session_state.permission_batch = None
+            session_state.trace = None
+            if session_state.active_query == events.query_id:
+                session_state.active_query = None
+            scheduler.release(ticket)
+            trace.finish(trace_exporter)
+            events.close()
+
+    task = asyncio.create_task(pump())
+    query_tasks.add(task)
+    task.add_done_callback(query_tasks.discard)
+    return events
+
+
+def require_active_session(token: Optional[str]) -> SessionState:
+    session_state = resolve_session(token)
+    if not session_state.session_active:
+        raise HTTPException(
+            status_code=400, detail="Session not initialized. Call /initialize first."
+        )
+    return session_state
 
-        while not query_done.is_set() or not event_queue.empty():
-            try:
-                event = await asyncio.wait_for(event_queue.get(), timeout=0.1)
-                yield event
-            except asyncio.TimeoutError:
-                continue
 
-        await query_task
-        monitor_task.cancel()
-        session_state.permission_queue = None
+def sse_response(session_state: SessionState, events: EventLog, after: int = 0):
+    async def event_generator():
+        async for seq, event, data, _ in follow_query(session_state, events, after):
+            yield sse_frame(event, data, seq)
 
     return EventSourceResponse(event_generator())
 
 
+def ndjson_response(session_state: SessionState, events: EventLog, after: int = 0):
+    async def line_generator():
+        async for seq, event, data, ts in follow_query(session_state, events, after):
+            yield ndjson_line(event, seq, ts, data)
+
+    return StreamingResponse(line_generator(), media_type="application/x-ndjson")
+
+
+@app.post("/query")
+async def query_agent(req: QueryRequest, x_session_token: Optional[str] = Header(None)):
+    session_state = require_active_session(x_session_token)
+    return sse_response(session_state, start_query(session_state, req))
+
+
+@app.post("/query/stream")
+async def query_agent_ndjson(
+    req: QueryRequest, x_session_token: Optional[str] = Header(None)
+):
+    """Same events as /query, one {event, seq, ts, data} JSON object per line."""
+    session_state = require_active_session(x_session_token)
+    return ndjson_response(session_state, start_query(session_state, req))
+
+
+@app.post("/query/{query_id}/cancel")
+async def cancel_query(query_id: str, x_session_token: Optional[str] = Header(None)):
+    """Interrupt a running query; its stream ends with cancelled, then complete."""
+    session_state = resolve_session(x_session_token)
+    events = session_state.queries.get(query_id)
+    if events is None:
+        raise HTTPException(status_code=404, detail="Query not found")
+    if events.closed:
+        return {"status": "finished"}
+    waiting = session_state.waiting.get(query_id)
+    if waiting is not None and scheduler.cancel(waiting[0]):
+        return {"status": "dequeued"}
+    if session_state.active_query != query_id:
+        raise HTTPException(status_code=409, detail="Query is not the one running")
+    await interrupt_query(session_state, "client")
+    return {"status": "cancelling"}
+
+
+@app.get("/query/{query_id}/events")
+async def resume_query(
+    query_id: str,
+    request: Request,
+    last_event_id: Optional[int] = Header(None),
+    after: Optional[int] = None,
+    x_session_token: Optional[str] = Header(None),
+):
+    """Replay a query's events after Last-Event-ID (or ?after=), then follow it live.
+
+    Sends SSE, or NDJSON when the Accept header asks for application/x-ndjson.
+    """
+    session_state = resolve_session(x_session_token)
+    events = session_state.queries.get(query_id)
+    if events is None:
+        raise HTTPException(status_code=404, detail="Query not found")
+    after = after if after is not None else last_event_id or 0
+    if after + 1 < events.first_seq:
+        raise HTTPException(
+            status_code=410,
+            detail=f"Events after {after} are no longer buffered (oldest is {events.first_seq})",
+        )
+    if "application/x-ndjson" in request.headers.get("accept", ""):
+        return ndjson_response(session_state, events, after)
+    return sse_response(session_state, events, after)
+
+
 @app.post("/shutdown")
-async def shutdown():
-    if session_state.sdk_client:
-        try:
-            await session_state.sdk_client.disconnect()
-            print("SDK client disconnected", file=sys.stderr)
-        except Exception as e:
-            print(f"Error disconnecting SDK client: {e}", file=sys.stderr)
-        session_state.sdk_client = None
-
-    session_state.session_active = False
-    session_state.working_dir = None
-    session_state.auth_method = None
-    session_state.permission_mode = None
-    session_state.allowed_tools = None
-    session_state.disallowed_tools = None
-    session_state.model = None
-    session_state.system_prompt = None
-    session_state.max_turns = None
-    session_state.env = None
-    session_state.add_dirs = None
-    session_state.session_id = None
+async def shutdown(x_session_token: Optional[str] = Header(None)):
+    session_state = sessions.get(x_session_token)
+    if session_state is not None:
+        await close_session(session_state)
+        sessions.remove(session_state.token)
     return {"status": "ok"}
 
 
 @app.get("/health")
-async def health():
+async def health(x_session_token: Optional[str] = Header(None)):
+    session_state = sessions.get(x_session_token)
+    active = session_state is not None and session_state.session_active
     return {
-        "status": "ok" if session_state.session_active else "not_initialized",
-        "working_dir": session_state.working_dir,
-        "auth_method": session_state.auth_method,
+        "status": "ok" if active else "not_initialized",
+        "working_dir": session_state.working_dir if session_state else None,
+        "auth_method": session_state.auth_method if session_state else None,
+        "sessions": len(sessions.sessions),
+        "prompt_cache": {
+            **session_state.usage_totals,
+            "hit_rate": prompt_cache_hit_rate(session_state.usage_totals),
+        }
+        if session_state
+        else None,
     }
 
 
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 def main():
     port = int(os.environ.get("PORT", 8765))
     host = os.environ.get("HOST", "127.0.0.1")
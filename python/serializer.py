@@ -0,0 +1,75 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Payloads estimated above this many characters are encoded on a worker
+# thread so a whole-file Write input doesn't stall every other stream.
+OFFLOAD_THRESHOLD = 256 * 1024
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def backend() -> str:
+    return "orjson" if orjson is not None else "json"
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # Integers beyond 64 bits and the like; the stdlib copes
+            pass
+    return json.dumps(obj).encode("utf-8")
+
+
+def approx_size(obj: Any, limit: int) -> int:
+    """Characters of string data in obj, counting no further than just past limit."""
+    total = 0
+    stack = [obj]
+    while stack and total <= limit:
+        item = stack.pop()
+        if isinstance(item, str):
+            total += len(item)
+        elif isinstance(item, dict):
+            total += sum(len(str(key)) for key in item)
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple)):
+            stack.extend(item)
+        else:
+            total += 8
+    return total
+
+
+async def encode(obj: Any) -> bytes:
+    if approx_size(obj, OFFLOAD_THRESHOLD) <= OFFLOAD_THRESHOLD:
+        return dumps(obj)
+
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="sse-encode")
+    return await asyncio.get_running_loop().run_in_executor(_executor, dumps, obj)
+
+
+def sse_frame(event: str, data: bytes, seq: Optional[int] = None) -> bytes:
+    # Same layout sse_starlette writes, but bytes go out without re-encoding
+    frame = b"event: " + event.encode("utf-8") + b"\r\ndata: " + data + b"\r\n\r\n"
+    if seq:
+        frame = b"id: %d\r\n" % seq + frame
+    return frame
+
+
+def ndjson_line(event: str, seq: int, ts: float, data: bytes) -> bytes:
+    return (
+        b'{"event": '
+        + dumps(event)
+        + b', "seq": %d, "ts": %.3f, "data": ' % (seq, ts)
+        + data
+        + b"}\n"
+    )
@@ -0,0 +1,68 @@
+import asyncio
+
+from client_pool import ClientPool
+
+
+class Client:
+    def __init__(self):
+        self.alive = True
+        self.disconnected = False
+
+    async def disconnect(self):
+        self.disconnected = True
+
+
+def pool_with(factory_delay=0.0, **options):
+    created = []
+
+    async def factory(slot, fields):
+        slot.client = Client()
+        created.append(slot.client)
+        await asyncio.sleep(factory_delay)
+
+    pool = ClientPool(factory, alive=lambda slot: slot.client.alive, **options)
+    return pool, created
+
+
+def test_checkout_warms_a_client_for_the_next_one():
+    async def run():
+        pool, created = pool_with(min_size=1)
+        first = await pool.acquire({"model": "m"})
+        await asyncio.sleep(0.01)
+        second = await pool.acquire({"model": "m"})
+        other = await pool.acquire({"model": "other"})
+        await pool.close()
+        return first, second, other, created
+
+    first, second, other, created = asyncio.run(run())
+    assert second.client is created[1] and first.client is created[0]
+    assert other.client not in (first.client, second.client)
+
+
+def test_dead_idle_client_is_dropped_not_handed_out():
+    async def run():
+        pool, created = pool_with(min_size=1)
+        await pool.acquire({})
+        await asyncio.sleep(0.01)
+        warmed = created[1]
+        warmed.alive = False
+        slot = await pool.acquire({})
+        await pool.close()
+        return warmed, slot
+
+    warmed, slot = asyncio.run(run())
+    assert slot.client is not warmed
+    assert warmed.disconnected
+
+
+def test_close_disconnects_clients_still_connecting():
+    async def run():
+        pool, created = pool_with(factory_delay=0.2, min_size=1)
+        slot = await pool.acquire({})
+        await asyncio.sleep(0.01)
+        await pool.close()
+        return slot, created
+
+    slot, created = asyncio.run(run())
+    connecting = created[1]
+    assert connecting.disconnected and not slot.client.disconnected
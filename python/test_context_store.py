@@ -0,0 +1,80 @@
+import difflib
+
+from context_store import ContextMissing, ContextStore, apply_unified_diff, resolve_context
+
+
+def make_diff(old: str, new: str) -> str:
+    return "\n".join(difflib.unified_diff(old.split("\n"), new.split("\n"), lineterm=""))
+
+
+def test_content_hash_round_trip():
+    store = ContextStore()
+    hashes = {}
+    text = "x <- 1\ny <- 2\n"
+
+    first = resolve_context(store, {"path": "a.R", "content": text}, hashes)
+    again = resolve_context(store, {"path": "a.R", "content_hash": first["content_hash"]}, hashes)
+
+    assert again["content"] == text
+    assert hashes["a.R"] == first["content_hash"]
+
+
+def test_diff_against_last_version_of_path():
+    store = ContextStore()
+    hashes = {}
+    old = "f <- function(x) {\n  x + 1\n}\n"
+    new = "f <- function(x) {\n  x + 2\n}\n"
+
+    resolve_context(store, {"path": "a.R", "content": old}, hashes)
+    resolved = resolve_context(store, {"path": "a.R", "content_diff": make_diff(old, new)}, hashes)
+
+    assert resolved["content"] == new
+    assert "content_diff" not in resolved
+
+
+def test_unknown_hash_is_reported_missing():
+    store = ContextStore()
+    try:
+        resolve_context(store, {"path": "a.R", "content_hash": "deadbeef"}, {})
+    except ContextMissing as e:
+        assert e.content_hash == "deadbeef"
+    else:
+        raise AssertionError("expected ContextMissing")
+
+
+def test_store_evicts_least_recently_used():
+    store = ContextStore(max_bytes=10)
+    first = store.put("aaaaaa")
+    second = store.put("bbbbbb")
+
+    assert store.get(first) is None
+    assert store.get(second) == "bbbbbb"
+
+
+def test_diff_that_does_not_apply_raises():
+    try:
+        apply_unified_diff("a\nb", make_diff("a\nc", "a\nd"))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("expected ValueError")
+
+
+def test_cap_counts_utf8_bytes():
+    store = ContextStore(max_bytes=12)
+    first = store.put("é" * 5)
+    store.put("ü" * 5)
+
+    assert store.size == 10
+    assert store.get(first) is None
+
+
+if __name__ == "__main__":
+    test_content_hash_round_trip()
+    test_diff_against_last_version_of_path()
+    test_unknown_hash_is_reported_missing()
+    test_store_evicts_least_recently_used()
+    test_diff_that_does_not_apply_raises()
+    test_cap_counts_utf8_bytes()
+    print("All tests passed")
+
@@ -0,0 +1,70 @@
+from context_window import build_prompt, enclosing_definitions, estimate_tokens, window_content
+
+
+R_SCRIPT = "\n".join(
+    ["outer <- function(a) {"]
+    + [f"  a <- a + {i}" for i in range(200)]
+    + ["  inner <- function(b) {", "    b * 2", "  }", "}"]
+    + [f"x{i} <- {i}" for i in range(100)]
+)
+
+
+def test_small_content_is_untouched():
+    text = "x <- 1\ny <- 2"
+    windowed, stats = window_content(text, (0, 0), budget=100)
+
+    assert windowed == text
+    assert stats["trimmed"] is False
+
+
+def test_enclosing_definitions_are_nested():
+    lines = R_SCRIPT.split("\n")
+    assert enclosing_definitions(lines, 202) == [201, 0]
+
+
+def test_window_keeps_selection_and_function_headers():
+    windowed, stats = window_content(R_SCRIPT, (202, 202), budget=20)
+
+    assert "outer <- function(a) {" in windowed
+    assert "  inner <- function(b) {" in windowed
+    assert "    b * 2" in windowed
+    assert "[lines 2-201 omitted]" in windowed
+    assert stats["trimmed"] is True
+    assert stats["context_tokens"] < stats["context_tokens_full"]
+
+
+def test_window_respects_budget_without_anchor():
+    windowed, stats = window_content(R_SCRIPT, None, budget=50)
+
+    assert windowed.startswith("outer <- function(a) {")
+    assert estimate_tokens(windowed) <= 60
+
+
+def test_prompt_puts_file_before_selection_and_question():
+    context = {
+        "path": "R/a.R",
+        "content": "x <- 1\ny <- 2",
+        "selection": {"text": "y <- 2", "range": {"start": {"line": 2}, "end": {"line": 2}}},
+    }
+    first, stats = build_prompt("What is y?", context, budget=100)
+    second, _ = build_prompt("And x?", dict(context, selection={"text": "x <- 1"}), budget=100)
+
+    assert first.index("Current file: R/a.R") < first.index("x <- 1\ny <- 2")
+    assert first.index("x <- 1\ny <- 2") < first.index("Selected code") < first.index("What is y?")
+    shared = first.split("Selected code")[0]
+    assert second.startswith(shared)
+    assert stats["stable_prefix_tokens"] == estimate_tokens(shared.rstrip("\n"))
+
+
+def test_prompt_without_context_is_the_question():
+    assert build_prompt("Hi", None, budget=100) == ("Hi", {})
+
+
+if __name__ == "__main__":
+    test_small_content_is_untouched()
+    test_enclosing_definitions_are_nested()
+    test_window_keeps_selection_and_function_headers()
+    test_window_respects_budget_without_anchor()
+    test_prompt_puts_file_before_selection_and_question()
+    test_prompt_without_context_is_the_question()
+    print("All tests passed")
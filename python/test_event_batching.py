@@ -0,0 +1,75 @@
+import asyncio
+import json
+
+from event_batching import coalesce_events, coalesce_frames
+from serializer import dumps
+
+DONE = object()
+
+
+def drain(events, window_ms):
+    async def run():
+        queue = asyncio.Queue()
+        for event in events:
+            queue.put_nowait(event)
+        queue.put_nowait(DONE)
+        return [event async for event in coalesce_events(queue, DONE, window_ms)]
+
+    return asyncio.run(run())
+
+
+def tool_use(i):
+    return {"event": "tool_use", "data": dumps({"id": f"toolu_{i}", "name": "Read"})}
+
+
+def test_unbatched_by_default():
+    events = [tool_use(i) for i in range(3)]
+    assert drain(events, None) == events
+
+
+def test_same_type_run_becomes_one_batch():
+    out = drain([tool_use(i) for i in range(3)], window_ms=20)
+
+    assert len(out) == 1
+    assert out[0]["event"] == "batch"
+    batch = json.loads(out[0]["data"])
+    assert batch["type"] == "tool_use"
+    assert [e["id"] for e in batch["events"]] == ["toolu_0", "toolu_1", "toolu_2"]
+
+
+def test_other_events_flush_and_pass_through():
+    permission = {"event": "permission_request", "data": dumps({"request_id": "p"})}
+    out = drain([tool_use(0), tool_use(1), permission, tool_use(2)], window_ms=20)
+
+    assert [e["event"] for e in out] == ["batch", "permission_request", "tool_use"]
+
+
+def test_tap_sees_events_before_merging():
+    seen = []
+
+    async def run():
+        queue = asyncio.Queue()
+        for i in range(3):
+            queue.put_nowait(tool_use(i))
+        queue.put_nowait(DONE)
+        return [e async for e in coalesce_events(queue, DONE, 20, tap=seen.append)]
+
+    assert [e["event"] for e in asyncio.run(run())] == ["batch"]
+    assert seen == [tool_use(i) for i in range(3)]
+
+
+def test_frames_batch_like_a_live_queue():
+    permission = {"event": "permission_request", "data": dumps({"request_id": "p"})}
+    events = [tool_use(0), tool_use(1), permission, tool_use(2)]
+
+    frames = list(coalesce_frames((e["event"], e["data"]) for e in events))
+    assert frames == [(e["event"], e["data"]) for e in drain(events, window_ms=20)]
+
+
+if __name__ == "__main__":
+    test_unbatched_by_default()
+    test_same_type_run_becomes_one_batch()
+    test_other_events_flush_and_pass_through()
+    test_tap_sees_events_before_merging()
+    test_frames_batch_like_a_live_queue()
+    print("All tests passed")
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from event_log import EventLog, EventsExpired
+
+
+def read(log, after=0):
+    async def run():
+        return [(seq, event) async for seq, event, _, _ in log.follow(after)]
+
+    return asyncio.run(run())
+
+
+def test_resume_after_last_seen_seq():
+    log = EventLog("q")
+    for event in ("query", "text", "text", "result", "complete"):
+        log.append(event, b"{}")
+    log.close()
+
+    assert read(log) == [(1, "query"), (2, "text"), (3, "text"), (4, "result"), (5, "complete")]
+    assert read(log, after=3) == [(4, "result"), (5, "complete")]
+    assert read(log, after=5) == []
+
+
+def test_ring_buffer_drops_oldest_by_bytes():
+    log = EventLog("q", max_bytes=10)
+    for _ in range(5):
+        log.append("text", b"xxxx")
+    log.close()
+
+    assert log.first_seq == 4
+    assert read(log, after=3) == [(4, "text"), (5, "text")]
+    with pytest.raises(EventsExpired):
+        read(log, after=1)
+
+
+def test_followers_see_events_appended_later():
+    async def run():
+        log = EventLog("q")
+        log.append("query", b"{}")
+
+        async def produce():
+            for _ in range(3):
+                await asyncio.sleep(0.01)
+                log.append("text", b"{}")
+            log.close()
+
+        producer = asyncio.create_task(produce())
+        first = [seq async for seq, _, _, _ in log.follow()]
+        second = [seq async for seq, _, _, _ in log.follow(2)]
+        await producer
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == [1, 2, 3, 4]
+    assert second == [3, 4]
+
+
+def test_attached_reader_never_loses_unread_events():
+    async def run():
+        log = EventLog("q", max_bytes=10)
+        reader = log.follow()
+        log.append("query", b"{}")
+        first = await reader.__anext__()
+        for _ in range(3):
+            log.append("text", b"x" * 8)
+        log.close()
+        rest = [entry async for entry in reader]
+        return first, rest, log
+
+    first, rest, log = asyncio.run(run())
+    assert first[0] == 1
+    assert [seq for seq, _, _, _ in rest] == [2, 3, 4]
+    # Once the reader is gone the cap applies again
+    assert log.first_seq == 4
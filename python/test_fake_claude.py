@@ -0,0 +1,77 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+from claude_agent_sdk import ClaudeSDKClient, ProcessError
+from claude_agent_sdk.types import (
+    ClaudeAgentOptions,
+    PermissionResultAllow,
+    PermissionResultDeny,
+)
+
+FAKE_CLI = str(Path(__file__).resolve().parent / "fake_claude.py")
+
+
+def run_turn(prompt, approve=True, env=None):
+    asked = []
+
+    async def can_use_tool(tool_name, input_data, context):
+        asked.append(tool_name)
+        return PermissionResultAllow() if approve else PermissionResultDeny(message="no")
+
+    async def run():
+        client = ClaudeSDKClient(
+            ClaudeAgentOptions(cli_path=FAKE_CLI, can_use_tool=can_use_tool, env=env or {})
+        )
+        await client.connect()
+        try:
+            await client.query(prompt)
+            return [message async for message in client.receive_response()]
+        finally:
+            await client.disconnect()
+
+    return asyncio.run(run()), asked
+
+
+def blocks(messages, block_type):
+    return [
+        block
+        for message in messages
+        for block in getattr(message, "content", None) or []
+        if type(block).__name__ == block_type
+    ]
+
+
+def test_default_turn_asks_permission_and_echoes():
+    messages, asked = run_turn("hello")
+    assert asked == ["Write"]
+    assert blocks(messages, "ToolResultBlock")[0].content == "File written"
+    assert blocks(messages, "TextBlock")[0].text == "Echo: hello"
+    assert type(messages[-1]).__name__ == "ResultMessage"
+
+
+def test_denied_tool_replays_as_error_result():
+    messages, _ = run_turn("hello", approve=False)
+    result = blocks(messages, "ToolResultBlock")[0]
+    assert result.is_error
+
+
+def test_replays_transcript(tmp_path):
+    transcript = tmp_path / "transcript.jsonl"
+    lines = [
+        {"type": "assistant", "message": {"model": "m", "content": [{"type": "text", "text": "one"}]}},
+        {"type": "fake_delay", "ms": 10},
+        {"type": "result", "subtype": "success", "is_error": False, "num_turns": 1, "total_cost_usd": 0.5},
+    ]
+    transcript.write_text("\n".join(json.dumps(line) for line in lines))
+
+    messages, asked = run_turn("ignored", env={"FAKE_CLAUDE_TRANSCRIPT": str(transcript)})
+    assert asked == []
+    assert [block.text for block in blocks(messages, "TextBlock")] == ["one"]
+    assert messages[-1].total_cost_usd == 0.5
+
+
+def test_injected_crash_surfaces_as_process_error():
+    with pytest.raises(ProcessError):
+        run_turn("hello", env={"FAKE_CLAUDE_CRASH_AFTER": "2", "FAKE_CLAUDE_EXIT_CODE": "3"})
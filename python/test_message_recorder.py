@@ -0,0 +1,47 @@
+import asyncio
+
+from claude_agent_sdk.types import (
+    AssistantMessage,
+    ResultMessage,
+    StreamEvent,
+    TextBlock,
+    ToolUseBlock,
+)
+
+from message_recorder import Recorder, ReplayClient, decode_value, encode_value
+
+MESSAGES = [
+    StreamEvent(uuid="u1", session_id="s", event={"type": "content_block_delta"}),
+    AssistantMessage(
+        content=[TextBlock(text="hi"), ToolUseBlock(id="t1", name="Read", input={"a": [1]})],
+        model="m",
+    ),
+    ResultMessage(
+        subtype="success",
+        duration_ms=3,
+        duration_api_ms=2,
+        is_error=False,
+        num_turns=1,
+        session_id="s",
+        usage={"input_tokens": 5},
+    ),
+]
+
+
+def test_messages_round_trip():
+    assert [decode_value(encode_value(m)) for m in MESSAGES] == MESSAGES
+
+
+def test_recorded_fixture_replays_in_order(tmp_path):
+    recorder = Recorder("prompt")
+    for message in MESSAGES:
+        recorder.add(message)
+    path = recorder.write(tmp_path / "one.jsonl.gz")
+
+    async def replay():
+        client = ReplayClient(str(tmp_path), speed=0)
+        await client.query("ignored")
+        return [message async for message in client.receive_response()]
+
+    assert path.exists()
+    assert asyncio.run(replay()) == MESSAGES
@@ -0,0 +1,43 @@
+from metrics import Registry
+
+
+def test_counter_renders_labelled_samples():
+    registry = Registry()
+    events = registry.counter("events_total", "Events by type.", ["type"])
+    events.inc(type="text")
+    events.inc(2, type="text")
+    events.inc(type='say "hi"')
+
+    text = registry.render()
+    assert "# TYPE events_total counter" in text
+    assert 'events_total{type="text"} 3.0' in text
+    assert 'events_total{type="say \\"hi\\""} 1.0' in text
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    wait = registry.histogram("wait_seconds", "Wait.", buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        wait.observe(value)
+
+    lines = registry.render().splitlines()
+    assert 'wait_seconds_bucket{le="0.1"} 1' in lines
+    assert 'wait_seconds_bucket{le="1.0"} 2' in lines
+    assert 'wait_seconds_bucket{le="+Inf"} 3' in lines
+    assert "wait_seconds_count 3" in lines
+    assert "wait_seconds_sum 5.55" in lines
+
+
+def test_function_gauge_reads_at_render_time():
+    registry = Registry()
+    pending = {"a": 1}
+    registry.gauge("pending", "Pending.", function=lambda: len(pending))
+    pending["b"] = 2
+    assert "pending 2.0" in registry.render()
+
+
+if __name__ == "__main__":
+    test_counter_renders_labelled_samples()
+    test_histogram_buckets_are_cumulative()
+    test_function_gauge_reads_at_render_time()
+    print("All tests passed")
@@ -0,0 +1,80 @@
+import pytest
+
+from permission_policy import PermissionPolicy, PermissionRule
+
+
+def policy(*rules):
+    return PermissionPolicy.from_dicts(list(rules), working_dir="/proj")
+
+
+def test_no_rules_means_ask():
+    assert policy().decide("Write", {"file_path": "a.R"}) is None
+
+
+def test_relative_globs_stay_inside_working_dir():
+    p = policy({"tool": "Write", "action": "allow", "paths": ["R/*.R"]})
+
+    assert p.decide("Write", {"file_path": "R/utils.R"}) == (True, "rule")
+    assert p.decide("Write", {"file_path": "/proj/R/utils.R"}) == (True, "rule")
+    assert p.decide("Write", {"file_path": "../other/R/utils.R"}) is None
+    assert p.decide("Write", {"file_path": "R/../../etc/R/x.R"}) is None
+    assert p.decide("Write", {"file_path": "DESCRIPTION"}) is None
+
+
+def test_absolute_globs():
+    p = policy({"tool": "Read", "action": "allow", "paths": ["/usr/lib/R/*"]})
+
+    assert p.decide("Read", {"file_path": "/usr/lib/R/etc/Renviron"}) == (True, "rule")
+    assert p.decide("Read", {"file_path": "/etc/passwd"}) is None
+
+
+def test_command_prefixes_reject_chained_commands():
+    p = policy({"tool": "Bash", "action": "allow", "command_prefixes": ["git status", "ls"]})
+
+    assert p.decide("Bash", {"command": "git status"}) == (True, "rule")
+    assert p.decide("Bash", {"command": "ls -la R"}) == (True, "rule")
+    assert p.decide("Bash", {"command": "lsof"}) is None
+    assert p.decide("Bash", {"command": "git status; rm -rf ~"}) is None
+    assert p.decide("Bash", {"command": "ls $(rm -rf ~)"}) is None
+
+
+def test_deny_wins_over_allow():
+    p = policy(
+        {"tool": "*", "action": "allow"},
+        {"tool": "Bash", "action": "deny", "command_prefixes": ["rm"]},
+    )
+
+    assert p.decide("Bash", {"command": "rm -rf R; ls"}) == (False, "rule")
+    assert p.decide("Bash", {"command": "ls"}) == (True, "rule")
+
+
+def test_remember_input_scope_matches_only_identical_input():
+    p = policy()
+    p.remember("Write", {"file_path": "a.R", "content": "x"}, True, "input")
+
+    assert p.decide("Write", {"content": "x", "file_path": "a.R"}) == (True, "remembered")
+    assert p.decide("Write", {"file_path": "a.R", "content": "y"}) is None
+
+
+def test_remember_tool_scope_overrides_rules():
+    p = policy({"tool": "Edit", "action": "allow"})
+    p.remember("Edit", {"file_path": "a.R"}, False, "tool")
+
+    assert p.decide("Edit", {"file_path": "b.R"}) == (False, "remembered")
+
+
+def test_invalid_rules_are_rejected():
+    with pytest.raises(ValueError):
+        PermissionRule.from_dict({"tool": "Write", "action": "maybe"})
+    with pytest.raises(ValueError):
+        PermissionRule.from_dict({"tool": "Write", "action": "allow", "glob": "*"})
+    with pytest.raises(ValueError):
+        policy().remember("Write", {}, True, "forever")
+
+
+def test_remembered_approval_cannot_override_deny_rule():
+    p = policy({"tool": "Bash", "action": "deny", "command_prefixes": ["rm"]})
+    p.remember("Bash", {"command": "ls"}, True, "tool")
+
+    assert p.decide("Bash", {"command": "rm -rf /"}) == (False, "rule")
+    assert p.decide("Bash", {"command": "ls"}) == (True, "remembered")
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from query_scheduler import QueryScheduler, QueueFull
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_one_query_at_a_time_per_session():
+    async def main():
+        scheduler = QueryScheduler(max_waiting=2)
+        first = scheduler.submit("a")
+        second = scheduler.submit("a")
+        other = scheduler.submit("b")
+
+        assert first.granted and other.granted
+        assert scheduler.position(second) == (1, "session")
+        scheduler.release(first)
+        assert second.granted
+
+    run(main())
+
+
+def test_queue_is_bounded():
+    async def main():
+        scheduler = QueryScheduler(max_waiting=1)
+        scheduler.submit("a")
+        scheduler.submit("a")
+        with pytest.raises(QueueFull):
+            scheduler.submit("a")
+        scheduler.submit("b")
+
+    run(main())
+
+
+def test_sessions_take_turns_for_server_slots():
+    async def main():
+        scheduler = QueryScheduler(max_waiting=4, max_running=1)
+        a1 = scheduler.submit("a")
+        a2 = scheduler.submit("a")
+        b1 = scheduler.submit("b")
+
+        assert a1.granted and not b1.granted
+        assert scheduler.position(b1) == (1, "server")
+        scheduler.release(a1)
+        # a's next query queues behind b's, which was already waiting
+        assert b1.granted and not a2.granted
+        scheduler.release(b1)
+        assert a2.granted
+
+    run(main())
+
+
+def test_wait_reports_positions_and_cancel():
+    async def main():
+        scheduler = QueryScheduler(max_waiting=4)
+        first = scheduler.submit("a")
+        second = scheduler.submit("a")
+        third = scheduler.submit("a")
+        seen = []
+
+        async def record(ahead, scope):
+            seen.append((ahead, scope))
+
+        waiter = asyncio.create_task(scheduler.wait(third, record))
+        await asyncio.sleep(0)
+        assert scheduler.cancel(second)
+        await asyncio.sleep(0)
+        scheduler.release(first)
+        assert await waiter is True
+        assert seen == [(2, "session"), (1, "session")]
+        assert not scheduler.cancel(third)
+        assert scheduler.waiting == 0
+
+    run(main())
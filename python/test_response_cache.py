@@ -0,0 +1,50 @@
+import json
+
+from response_cache import ResponseCache, cache_key, cacheable_turn, mark_cached
+
+
+def frames(text):
+    return [("text", json.dumps({"text": text}).encode()), ("result", b'{"is_error": false}')]
+
+
+def test_key_ignores_whitespace_and_case_but_not_context():
+    base = cache_key("m", None, "/proj", "Explain  this\\nfunction", {"path": "a.R", "content": "x"})
+
+    assert base == cache_key("m", None, "/proj", " explain this\\nFUNCTION ", {"content": "x", "path": "a.R"})
+    assert base != cache_key("m", None, "/proj", "explain this\\nfunction", {"path": "a.R", "content": "y"})
+    assert base != cache_key("other", None, "/proj", "explain this\\nfunction", {"path": "a.R", "content": "x"})
+
+
+def test_only_read_only_turns_are_cacheable():
+    assert cacheable_turn([])
+    assert cacheable_turn(["Read", "Grep"])
+    assert not cacheable_turn(["Read", "Edit"])
+    assert not cacheable_turn(["mcp__db__query"])
+
+
+def test_lru_eviction_by_bytes():
+    cache = ResponseCache(max_bytes=120)
+    cache.put("a", frames("a" * 20))
+    cache.put("b", frames("b" * 20))
+    cache.get("a")
+    cache.put("c", frames("c" * 20))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.size <= 120
+    assert not cache.put("huge", frames("x" * 200))
+
+
+def test_entries_expire():
+    cache = ResponseCache(ttl=-1)
+    cache.put("a", frames("a"))
+
+    assert cache.get("a") is None
+    assert cache.size == 0
+
+
+def test_mark_cached():
+    assert json.loads(mark_cached(b'{"is_error": false}')) == {"is_error": False, "cached": True}
+    assert json.loads(mark_cached(b"{}")) == {"cached": True}
+    spent = b'{"total_cost_usd": 0.2, "usage": {"output_tokens": 9}, "session_id": "other"}'
+    assert json.loads(mark_cached(spent)) == {"total_cost_usd": 0.0, "cached": True}
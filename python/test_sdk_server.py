@@ -0,0 +1,329 @@
+import asyncio
+import difflib
+import json
+import socket
+import time
+
+import httpx
+import pytest
+
+import sdk_server
+from loadgen import spawn_server
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="module")
+def http(tmp_path_factory):
+    port = free_port()
+    store = tmp_path_factory.mktemp("store") / "sessions.json"
+    proc = spawn_server(
+        port,
+        {
+            "CLAUDE_RESUME_GRACE": "30",
+            "CLAUDE_POOL_MIN_SIZE": "0",
+            "CLAUDE_SESSION_STORE": str(store),
+        },
+    )
+    client = httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=30)
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            client.get("/health")
+            break
+        except httpx.HTTPError:
+            if time.monotonic() > deadline or proc.poll() is not None:
+                proc.kill()
+                raise
+            time.sleep(0.2)
+    yield client
+    client.close()
+    proc.terminate()
+    proc.wait(10)
+
+
+def initialize(http, tmp_path, transcript=None, **options):
+    env = {"FAKE_CLAUDE_TRANSCRIPT": str(transcript)} if transcript else {}
+    body = {"working_dir": str(tmp_path), "auth_method": "subscription", "env": env, **options}
+    response = http.post("/initialize", json=body)
+    assert response.status_code == 200, response.text
+    return {"X-Session-Token": response.json()["session_token"]}
+
+
+def write_transcript(path, *lines):
+    path.write_text("\n".join(json.dumps(line) for line in lines))
+    return path
+
+
+def tool_call(*names):
+    return {
+        "type": "assistant",
+        "message": {
+            "model": "m",
+            "content": [
+                {"type": "tool_use", "id": f"t{i}", "name": name, "input": {"file_path": f"{i}.R"}}
+                for i, name in enumerate(names)
+            ],
+        },
+    }
+
+
+RESULT = {"type": "result", "subtype": "success", "is_error": False, "num_turns": 1}
+
+
+def query(http, headers, on_event=None, **body):
+    """Run one query over /query/stream; on_event(event, data) sees each line as it arrives."""
+    events = []
+    with http.stream("POST", "/query/stream", json=body, headers=headers) as response:
+        assert response.status_code == 200, response.read()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            envelope = json.loads(line)
+            events.append((envelope["event"], envelope["data"]))
+            if on_event:
+                on_event(envelope["event"], envelope["data"])
+    return events
+
+
+def names(events):
+    return [event for event, _ in events]
+
+
+def test_parallel_permissions_batch_and_bulk_approve(http, tmp_path):
+    transcript = write_transcript(
+        tmp_path / "t.jsonl", tool_call("Write", "Edit"), {"type": "fake_delay", "ms": 10}, RESULT
+    )
+    headers = initialize(http, tmp_path, transcript)
+    bulk = []
+
+    def on_event(event, data):
+        if event == "permission_batch":
+            decisions = [
+                {"request_id": request["request_id"], "approved": True}
+                for request in data["requests"]
+            ]
+            decisions.append({"request_id": "perm_unknown", "approved": True})
+            bulk.append(http.post("/approve/bulk", json={"decisions": decisions}, headers=headers))
+
+    events = query(http, headers, on_event, prompt="go", permission_batch_ms=300)
+
+    batch = dict(events)["permission_batch"]
+    assert [request["tool_name"] for request in batch["requests"]] == ["Write", "Edit"]
+    assert [item["status"] for item in bulk[0].json()["results"]] == ["ok", "ok", "not_found"]
+    assert "permission_request" not in names(events)
+    assert names(events)[-1] == "complete"
+
+
+def test_cancelled_batch_opener_still_announces_the_rest():
+    async def run():
+        state = sdk_server.SessionState("t")
+        state.event_queue = asyncio.Queue()
+        state.permission_batch_ms = 50
+        opener = asyncio.create_task(sdk_server.announce_permission(state, {"request_id": "a"}))
+        await asyncio.sleep(0.01)
+        await sdk_server.announce_permission(state, {"request_id": "b"})
+        opener.cancel()
+        event = await asyncio.wait_for(state.event_queue.get(), 1)
+        return event, state.permission_batch
+
+    event, batch = asyncio.run(run())
+    assert event["event"] == "permission_request"
+    assert json.loads(event["data"])["request_id"] == "b"
+    assert batch is None
+
+
+def text(value):
+    return {"type": "assistant", "message": {"model": "m", "content": [{"type": "text", "text": value}]}}
+
+
+def test_cached_answer_is_rebatched_per_request_and_free(http, tmp_path):
+    transcript = write_transcript(
+        tmp_path / "t.jsonl",
+        tool_call("Read"),
+        text("one"),
+        text("two"),
+        dict(RESULT, total_cost_usd=0.25, usage={"input_tokens": 5, "output_tokens": 7}),
+    )
+    headers = initialize(http, tmp_path, transcript)
+
+    first = query(http, headers, prompt="explain", cache=True, batch_window_ms=50)
+    second = query(http, headers, prompt="explain", cache=True)
+
+    assert "batch" in names(first)
+    assert "batch" not in names(second)
+    assert [data["text"] for event, data in second if event == "text"] == ["one", "two"]
+    result = dict(second)["result"]
+    assert result["cached"] is True
+    assert result["total_cost_usd"] == 0.0
+    assert "usage" not in result and "session_id" not in result
+
+
+def test_resume_requires_the_callers_own_session_id(http, tmp_path):
+    headers = initialize(http, tmp_path, write_transcript(tmp_path / "t.jsonl", text("hi"), RESULT))
+    session_id = dict(query(http, headers, prompt="hi"))["result"]["session_id"]
+    http.post("/shutdown", headers=headers)
+
+    other = http.post(
+        "/initialize",
+        json={"working_dir": str(tmp_path), "auth_method": "subscription", "resume": "guess"},
+    )
+    assert other.json()["resumed_session_id"] is None
+
+    again = http.post(
+        "/initialize",
+        json={"working_dir": str(tmp_path), "auth_method": "subscription", "resume": session_id},
+    )
+    assert again.json()["resumed_session_id"] == session_id
+
+
+def test_query_behind_an_orphaned_prompt_does_not_wait_out_the_grace(http, tmp_path):
+    transcript = write_transcript(
+        tmp_path / "t.jsonl", tool_call("Write"), RESULT, text("second"), RESULT
+    )
+    headers = initialize(http, tmp_path, transcript)
+    with http.stream("POST", "/query/stream", json={"prompt": "one"}, headers=headers) as response:
+        for line in response.iter_lines():
+            envelope = json.loads(line)
+            if envelope["event"] == "query":
+                orphan = envelope["data"]["query_id"]
+            if envelope["event"] == "permission_request":
+                break
+    time.sleep(0.5)
+
+    started = time.monotonic()
+    events = query(http, headers, prompt="two")
+    assert time.monotonic() - started < 10
+    assert names(events)[-1] == "complete"
+
+    resumed = http.get(
+        f"/query/{orphan}/events", headers={**headers, "Accept": "application/x-ndjson"}
+    )
+    orphaned = dict((e["event"], e["data"]) for e in map(json.loads, resumed.text.splitlines()))
+    assert orphaned["result"]["permissions"] == {"disconnect": 1}
+
+
+def test_sessions_are_isolated_and_need_their_token(http, tmp_path):
+    transcript = write_transcript(tmp_path / "t.jsonl", text("hi"), RESULT)
+    first = initialize(http, tmp_path, transcript)
+    second = initialize(http, tmp_path, transcript)
+    assert first != second
+
+    assert http.post("/query", json={"prompt": "hi"}).status_code == 400
+    assert http.post("/approve", json={"request_id": "x", "approved": True}).status_code == 400
+    assert http.get("/health").json()["status"] == "not_initialized"
+    assert http.post("/shutdown", headers=second).status_code == 200
+
+    assert http.get("/health", headers=second).json()["status"] == "not_initialized"
+    assert http.get("/health", headers=first).json()["status"] == "ok"
+    assert names(query(http, first, prompt="hi"))[-1] == "complete"
+    response = http.post("/query", json={"prompt": "hi"}, headers=second)
+    assert response.status_code == 404
+
+
+def test_unanswered_prompt_times_out(http, tmp_path):
+    transcript = write_transcript(tmp_path / "t.jsonl", tool_call("Write"), RESULT)
+    headers = initialize(
+        http, tmp_path, transcript, permission_timeout=0.3, permission_timeout_action="deny"
+    )
+
+    events = query(http, headers, prompt="go")
+
+    request = dict(events)["permission_request"]
+    assert dict(events)["permission_timeout"] == {
+        "request_id": request["request_id"],
+        "approved": False,
+    }
+    assert dict(events)["result"]["permissions"] == {"timeout": 1}
+    assert names(events)[-1] == "complete"
+
+
+def test_pending_prompts_are_capped(http, tmp_path):
+    transcript = write_transcript(tmp_path / "t.jsonl", tool_call(*["Write"] * 33), RESULT)
+    headers = initialize(http, tmp_path, transcript, permission_timeout=0.5)
+
+    events = query(http, headers, prompt="go")
+
+    assert names(events).count("permission_request") == 32
+    assert dict(events)["permission_auto"]["source"] == "limit"
+    assert dict(events)["result"]["permissions"] == {"timeout": 32, "limit": 1}
+
+
+def test_cancel_ends_the_turn_with_cancelled_then_complete(http, tmp_path):
+    transcript = write_transcript(tmp_path / "t.jsonl", tool_call("Write"), text("late"), RESULT)
+    headers = initialize(http, tmp_path, transcript)
+    cancels = []
+
+    def on_event(event, data):
+        if event == "query":
+            cancels.append(data["query_id"])
+        elif event == "permission_request":
+            cancels.append(http.post(f"/query/{cancels[0]}/cancel", headers=headers).json())
+
+    events = query(http, headers, on_event, prompt="go")
+
+    assert cancels[1]["status"] == "cancelling"
+    assert names(events)[-2:] == ["cancelled", "complete"]
+    assert dict(events)["cancelled"]["reason"] == "client"
+    assert "late" not in [data.get("text") for event, data in events if event == "text"]
+    again = http.post(f"/query/{cancels[0]}/cancel", headers=headers)
+    assert again.json() == {"status": "finished"}
+
+
+def test_reinitialize_restores_default_permission_deadline(http, tmp_path):
+    transcript = write_transcript(tmp_path / "t.jsonl", tool_call("Write"), RESULT)
+    headers = initialize(
+        http, tmp_path, transcript, permission_timeout=0.3, permission_timeout_action="allow"
+    )
+    body = {"working_dir": str(tmp_path), "auth_method": "subscription"}
+    body["env"] = {"FAKE_CLAUDE_TRANSCRIPT": str(transcript)}
+    assert http.post("/initialize", json=body, headers=headers).status_code == 200
+
+    def on_event(event, data):
+        if event == "permission_request":
+            time.sleep(0.6)
+            http.post(
+                "/approve",
+                json={"request_id": data["request_id"], "approved": False},
+                headers=headers,
+            )
+
+    events = query(http, headers, on_event, prompt="go")
+
+    assert "permission_timeout" not in names(events)
+    assert dict(events)["result"]["permissions"] == {"user": 1}
+
+
+def test_reinitialize_starts_usage_and_context_over(http, tmp_path):
+    usage = {"input_tokens": 5, "cache_read_input_tokens": 15, "output_tokens": 1}
+    transcript = write_transcript(tmp_path / "t.jsonl", text("hi"), dict(RESULT, usage=usage))
+    headers = initialize(http, tmp_path, transcript)
+    old, new = "x <- 1\n", "x <- 2\n"
+    query(http, headers, prompt="hi", context={"path": "a.R", "content": old})
+    assert http.get("/health", headers=headers).json()["prompt_cache"]["hit_rate"] == 0.75
+
+    body = {"working_dir": str(tmp_path), "auth_method": "subscription"}
+    body["env"] = {"FAKE_CLAUDE_TRANSCRIPT": str(transcript)}
+    assert http.post("/initialize", json=body, headers=headers).status_code == 200
+
+    assert http.get("/health", headers=headers).json()["prompt_cache"] == {"hit_rate": None}
+    diff = "\n".join(difflib.unified_diff(old.split("\n"), new.split("\n"), lineterm=""))
+    events = query(http, headers, prompt="hi", context={"path": "a.R", "content_diff": diff})
+    assert names(events)[-1] == "context_missing"
+
+
+def test_partial_messages_stream_text_deltas(http, tmp_path):
+    answer = "The model fits the data well; residuals look fine."
+    transcript = write_transcript(tmp_path / "t.jsonl", text(answer), RESULT)
+    headers = initialize(http, tmp_path, transcript, stream_partial=True)
+
+    events = query(http, headers, prompt="hi")
+
+    deltas = [data["text"] for event, data in events if event == "text_delta"]
+    assert len(deltas) > 1 and "".join(deltas) == answer
+    assert names(events).index("text_delta") < names(events).index("text")
+    assert dict(events)["text"] == {"text": answer, "streamed": True}
@@ -0,0 +1,116 @@
+import asyncio
+import json
+import threading
+from contextlib import contextmanager, nullcontext
+
+import pytest
+
+import serializer
+from serializer import OFFLOAD_THRESHOLD, approx_size, dumps, encode, ndjson_line, sse_frame
+
+
+@contextmanager
+def stdlib_only():
+    saved = serializer.orjson
+    serializer.orjson = None
+    try:
+        yield
+    finally:
+        serializer.orjson = saved
+
+
+# The installed backend (orjson when the "fast" extra is present) and the stdlib
+BACKENDS = (nullcontext, stdlib_only)
+
+
+@contextmanager
+def recording_threads():
+    threads = []
+    saved = serializer.dumps
+
+    def record(obj):
+        threads.append(threading.current_thread().name)
+        return saved(obj)
+
+    serializer.dumps = record
+    try:
+        yield threads
+    finally:
+        serializer.dumps = saved
+
+
+def test_backends_agree():
+    event = {"text": "héllo", "n": 3, "ok": True, "items": [1.5, None]}
+
+    with stdlib_only():
+        assert serializer.backend() == "json"
+        stdlib = dumps(event)
+
+    assert isinstance(stdlib, bytes)
+    assert json.loads(stdlib) == json.loads(dumps(event)) == event
+
+
+@pytest.mark.skipif(serializer.orjson is None, reason="orjson not installed")
+def test_falls_back_to_stdlib_on_type_error():
+    assert serializer.backend() == "orjson"
+    assert dumps({"n": 2**70}) == b'{"n": 1180591620717411303424}'
+
+
+def test_approx_size_counts_strings_and_keys():
+    assert approx_size({"ab": "cde", "f": ["gh", 1]}, 100) == 2 + 3 + 1 + 2 + 8
+    assert approx_size("x" * 10, 100) == 10
+
+
+def test_approx_size_stops_past_the_limit():
+    assert approx_size(["x" * 10] * 1000, 25) == 30
+
+
+def test_small_payloads_encode_on_the_loop():
+    with recording_threads() as threads:
+        data = asyncio.run(encode({"text": "short"}))
+
+    assert json.loads(data) == {"text": "short"}
+    assert threads == [threading.current_thread().name]
+
+
+def test_large_payloads_encode_off_the_loop():
+    event = {"input": {"content": "x" * (OFFLOAD_THRESHOLD + 1)}}
+
+    for backend in BACKENDS:
+        with backend(), recording_threads() as threads:
+            data = asyncio.run(encode(event))
+
+        assert json.loads(data) == event
+        assert len(threads) == 1 and threads[0].startswith("sse-encode")
+
+
+def test_sse_frame_layout():
+    assert sse_frame("text", b'{"a": 1}') == b'event: text\r\ndata: {"a": 1}\r\n\r\n'
+    assert sse_frame("text", b"{}", seq=7) == b"id: 7\r\nevent: text\r\ndata: {}\r\n\r\n"
+
+
+def test_ndjson_line_wraps_encoded_data():
+    for backend in BACKENDS:
+        with backend():
+            line = ndjson_line("text", 3, 12.34567, dumps({"text": "hi"}))
+
+            assert line.endswith(b"}\n") and line.count(b"\n") == 1
+            assert json.loads(line) == {
+                "event": "text",
+                "seq": 3,
+                "ts": 12.346,
+                "data": {"text": "hi"},
+            }
+
+
+if __name__ == "__main__":
+    test_backends_agree()
+    if serializer.orjson is not None:
+        test_falls_back_to_stdlib_on_type_error()
+    test_approx_size_counts_strings_and_keys()
+    test_approx_size_stops_past_the_limit()
+    test_small_payloads_encode_on_the_loop()
+    test_large_payloads_encode_off_the_loop()
+    test_sse_frame_layout()
+    test_ndjson_line_wraps_encoded_data()
+    print("All tests passed")
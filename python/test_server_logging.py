@@ -0,0 +1,83 @@
+import io
+import json
+import logging
+import sys
+import threading
+from contextlib import contextmanager
+
+from server_logging import JsonFormatter, setup_logging
+
+
+@contextmanager
+def captured_logging(**options):
+    """Run setup_logging against a buffer; yields the buffer, restores the root logger."""
+    root = logging.getLogger()
+    handlers, level, stderr = list(root.handlers), root.level, sys.stderr
+    sys.stderr = buffer = io.StringIO()
+    try:
+        listener = setup_logging(**options)
+        try:
+            yield buffer
+        finally:
+            listener.stop()
+    finally:
+        root.handlers[:] = handlers
+        root.setLevel(level)
+        sys.stderr = stderr
+
+
+def entries(buffer):
+    return [json.loads(line) for line in buffer.getvalue().splitlines()]
+
+
+def test_json_lines_carry_fields_and_extras():
+    with captured_logging(level="info", fmt="json") as buffer:
+        log = logging.getLogger("sdk_server")
+        log.debug("hidden")
+        log.info("query %s done", "q1", extra={"source": "cli_stderr", "ms": 12})
+
+    [entry] = entries(buffer)
+    assert set(entry) == {"ts", "level", "logger", "msg", "source", "ms"}
+    assert entry["level"] == "info"
+    assert entry["logger"] == "sdk_server"
+    assert entry["msg"] == "query q1 done"
+    assert entry["source"] == "cli_stderr" and entry["ms"] == 12
+
+
+def test_exceptions_are_formatted_on_the_listener_thread():
+    threads = []
+    format_exception = JsonFormatter.formatException
+
+    def record(self, exc_info):
+        threads.append(threading.current_thread())
+        return format_exception(self, exc_info)
+
+    JsonFormatter.formatException = record
+    try:
+        with captured_logging(level="info", fmt="json") as buffer:
+            try:
+                raise ValueError("boom")
+            except ValueError:
+                logging.getLogger("sdk_server").exception("failed")
+    finally:
+        JsonFormatter.formatException = format_exception
+
+    [entry] = entries(buffer)
+    assert entry["level"] == "error"
+    assert "ValueError: boom" in entry["exc"]
+    assert threads and threads[0] is not threading.current_thread()
+
+
+def test_text_format():
+    with captured_logging(level="warning", fmt="text") as buffer:
+        logging.getLogger("sdk_server").info("hidden")
+        logging.getLogger("sdk_server").warning("slow client")
+
+    assert buffer.getvalue().strip().endswith("WARNING sdk_server: slow client")
+
+
+if __name__ == "__main__":
+    test_json_lines_carry_fields_and_extras()
+    test_exceptions_are_formatted_on_the_listener_thread()
+    test_text_format()
+    print("All tests passed")
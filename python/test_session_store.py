@@ -0,0 +1,49 @@
+import json
+
+from session_store import SessionStore
+
+
+def test_sessions_survive_a_reload(tmp_path):
+    path = tmp_path / "sessions.json"
+    store = SessionStore(str(path))
+    store.put("sess-1", str(tmp_path / "proj"), {"model": "m", "system_prompt": None, "env": {"K": "v"}})
+
+    entry = SessionStore(str(path)).get("sess-1", str(tmp_path / "proj" / ".." / "proj"))
+    assert entry["options"] == {"model": "m"}
+
+
+def test_resume_needs_the_id_and_its_working_dir(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.json"))
+    store.put("sess-a", "/proj", {})
+    store.put("sess-b", "/proj", {})
+
+    assert store.get("sess-a", "/proj") is not None
+    assert store.get("sess-a", "/other") is None
+    assert store.get("sess-c", "/proj") is None
+
+
+def test_remove(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.json"))
+    store.put("sess-1", "/a", {})
+
+    assert store.remove("sess-1") is True
+    assert store.remove("sess-1") is False
+    assert SessionStore(str(tmp_path / "sessions.json")).get("sess-1", "/a") is None
+
+
+def test_oldest_entries_are_dropped(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.json"), max_entries=2)
+    for i in range(3):
+        store.put(f"sess-{i}", "/p", {})
+
+    assert store.get("sess-0", "/p") is None
+    assert store.get("sess-1", "/p") is not None and store.get("sess-2", "/p") is not None
+
+
+def test_unreadable_file_is_empty(tmp_path):
+    path = tmp_path / "sessions.json"
+    path.write_text("{not json")
+    assert SessionStore(str(path)).entries == {}
+
+    path.write_text(json.dumps({"sess-1": {"options": {}}}))
+    assert SessionStore(str(path)).get("sess-1", "/a") is None
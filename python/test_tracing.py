@@ -0,0 +1,40 @@
+import json
+
+from tracing import Trace, annotate
+
+
+def test_spans_share_trace_and_hang_off_root():
+    trace = Trace("query", session="abc")
+    with trace.span("sdk.query"):
+        pass
+    trace.finish()
+
+    root, child = [span.to_otlp() for span in trace.spans]
+    assert root["traceId"] == child["traceId"] == trace.trace_id
+    assert "parentSpanId" not in root
+    assert child["parentSpanId"] == root["spanId"]
+    assert int(child["endTimeUnixNano"]) >= int(child["startTimeUnixNano"])
+    assert root["attributes"] == [{"key": "session", "value": {"stringValue": "abc"}}]
+
+
+def test_span_records_exception_as_error_status():
+    trace = Trace("query")
+    try:
+        with trace.span("context_resolve"):
+            raise ValueError("boom")
+    except ValueError:
+        pass
+    assert trace.spans[1].to_otlp()["status"] == {"code": 2, "message": "boom"}
+
+
+def test_annotate_splices_into_encoded_object():
+    data = json.loads(annotate(b'{"text":"hi"}', "t1", 12.5))
+    assert data == {"trace_id": "t1", "server_ts": 12.5, "text": "hi"}
+    assert json.loads(annotate(b"{}", "t1", 1.0)) == {"trace_id": "t1", "server_ts": 1.0}
+
+
+if __name__ == "__main__":
+    test_spans_share_trace_and_hang_off_root()
+    test_span_records_exception_as_error_status()
+    test_annotate_splices_into_encoded_object()
+    print("All tests passed")
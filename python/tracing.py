@@ -0,0 +1,140 @@
+import logging
+import logging.handlers
+import os
+import queue
+import secrets
+import time
+from typing import Any, Dict, List, Optional
+
+from serializer import dumps
+
+
+def _attribute_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Span:
+    def __init__(self, trace: "Trace", name: str, parent: Optional["Span"], attributes):
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, Any] = dict(attributes)
+        self.error: Optional[str] = None
+
+    def set(self, **attributes: Any):
+        self.attributes.update(attributes)
+
+    def end(self, error: Optional[str] = None, **attributes: Any):
+        if self.end_ns is not None:
+            return
+        self.attributes.update(attributes)
+        self.error = error
+        self.end_ns = time.time_ns()
+
+    def __enter__(self) -> "Span":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end(error=str(exc) if exc is not None else None)
+        return False
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """The span in OTLP/JSON field names, so collectors can ingest the file."""
+        record = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": [
+                {"key": key, "value": _attribute_value(value)}
+                for key, value in self.attributes.items()
+                if value is not None
+            ],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            record["parentSpanId"] = self.parent_id
+        return record
+
+
+class Trace:
+    """All spans of one /query, rooted at a span named after the request."""
+
+    def __init__(self, name: str, **attributes: Any):
+        self.trace_id = secrets.token_hex(16)
+        self.spans: List[Span] = []
+        self.root = self.span(name, parent=None, **attributes)
+
+    def span(self, name: str, parent: Optional[Span] = ..., **attributes: Any) -> Span:
+        # Spans hang off the root unless a parent is given explicitly
+        if parent is ...:
+            parent = self.root
+        span = Span(self, name, parent, attributes)
+        self.spans.append(span)
+        return span
+
+    def finish(self, exporter: Optional["TraceExporter"] = None):
+        for span in self.spans:
+            span.end()
+        if exporter is not None:
+            exporter.export(self)
+
+
+class TraceExporter:
+    """Appends finished traces, one span per line, to a size-rotated JSONL file.
+
+    Writes happen on a listener thread, the same way server_logging keeps
+    stderr off the event loop.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 3):
+        self.path = path
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        self._records = queue.SimpleQueue()
+        self._listener = logging.handlers.QueueListener(self._records, handler)
+        self._handler = handler
+
+    def start(self):
+        self._listener.start()
+
+    def stop(self):
+        self._listener.stop()
+        self._handler.close()
+
+    def export(self, trace: Trace):
+        for span in trace.spans:
+            line = dumps(span.to_otlp()).decode("utf-8")
+            self._records.put(logging.makeLogRecord({"msg": line, "levelno": logging.INFO}))
+
+
+def exporter_from_env() -> Optional[TraceExporter]:
+    path = os.environ.get("CLAUDE_TRACE_FILE")
+    if not path:
+        return None
+    return TraceExporter(
+        path,
+        max_bytes=int(os.environ.get("CLAUDE_TRACE_FILE_MB", 10)) * 1024 * 1024,
+        backup_count=int(os.environ.get("CLAUDE_TRACE_FILE_BACKUPS", 3)),
+    )
+
+
+def annotate(data: bytes, trace_id: str, ts: float) -> bytes:
+    """Splice trace_id and a server timestamp into an encoded JSON object."""
+    head = b'{"trace_id": "' + trace_id.encode("ascii") + b'", "server_ts": %.6f' % ts
+    if data == b"{}":
+        return head + b"}"
+    return head + b", " + data[1:]